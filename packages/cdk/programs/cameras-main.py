@@ -8,6 +8,9 @@ import tempfile
 import os
 import psutil
 import threading
+import signal
+import sys
+from cloudwatch_metrics import MetricsBuffer  # Deploy cloudwatch_metrics.py alongside this script
 
 # Configure logging
 logs_dir = "/tmp/logs"
@@ -43,6 +46,10 @@ s3_client = boto3.client('s3', aws_access_key_id=aws_access_key_id,
 cloudwatch_client = boto3.client('cloudwatch', aws_access_key_id=aws_access_key_id,
                                  aws_secret_access_key=aws_secret_access_key, region_name=region_name)
 
+# Uploads happen every few seconds; metrics are aggregated and sent once a minute
+metrics = MetricsBuffer('casa-cameras', cloudwatch_client, logger=logger)
+CAMERA_DIMENSIONS = [{'Name': 'CameraStream', 'Value': 'Camera1'}]
+
 def upload_to_s3(file_path, s3_path):
     try:
         s3_client.upload_file(file_path, bucket_name, s3_path)
@@ -53,96 +60,22 @@ def upload_to_s3(file_path, s3_path):
         logger.error("Credentials not available")
 
 def emit_cloudwatch_metric(file_size):
+    """Record upload and host metrics; the buffer sends them in batches on its own thread."""
     try:
         memory = psutil.virtual_memory()
         cpu = psutil.cpu_percent()
         disk = psutil.disk_usage('/')
 
-        cloudwatch_client.put_metric_data(
-            Namespace='casa-cameras',
-            MetricData=[
-                {
-                    'MetricName': 'SuccessfulUploads',
-                    'Dimensions': [
-                        {
-                            'Name': 'CameraStream',
-                            'Value': 'Camera1'
-                        },
-                    ],
-                    'Unit': 'Count',
-                    'Value': 1
-                },
-                {
-                    'MetricName': 'UploadFileSize',
-                    'Dimensions': [
-                        {
-                            'Name': 'CameraStream',
-                            'Value': 'Camera1'
-                        },
-                    ],
-                    'Unit': 'Bytes',
-                    'Value': file_size
-                },
-                {
-                    'MetricName': 'TotalMemoryAvailable',
-                    'Dimensions': [
-                        {
-                            'Name': 'CameraStream',
-                            'Value': 'Camera1'
-                        },
-                    ],
-                    'Unit': 'Bytes',
-                    'Value': memory.total
-                },
-                {
-                    'MetricName': 'TotalMemoryFree',
-                    'Dimensions': [
-                        {
-                            'Name': 'CameraStream',
-                            'Value': 'Camera1'
-                        },
-                    ],
-                    'Unit': 'Bytes',
-                    'Value': memory.available
-                },
-                {
-                    'MetricName': 'MemoryUtilizationPercent',
-                    'Dimensions': [
-                        {
-                            'Name': 'CameraStream',
-                            'Value': 'Camera1'
-                        },
-                    ],
-                    'Unit': 'Percent',
-                    'Value': memory.percent
-                },
-                {
-                    'MetricName': 'TotalCpuUtilization',
-                    'Dimensions': [
-                        {
-                            'Name': 'CameraStream',
-                            'Value': 'Camera1'
-                        },
-                    ],
-                    'Unit': 'Percent',
-                    'Value': cpu
-                },
-                {
-                    'MetricName': 'DiskUtilizationPercent',
-                    'Dimensions': [
-                        {
-                            'Name': 'CameraStream',
-                            'Value': 'Camera1'
-                        },
-                    ],
-                    'Unit': 'Percent',
-                    'Value': disk.percent
-                },
-            ]
-        )
-        logger.info("Successfully emitted metrics to CloudWatch")
+        metrics.increment('SuccessfulUploads', dimensions=CAMERA_DIMENSIONS)
+        metrics.observe('UploadFileSize', file_size, 'Bytes', CAMERA_DIMENSIONS)
+        # Host readings only need their latest value per flush
+        metrics.gauge('TotalMemoryAvailable', memory.total, 'Bytes', CAMERA_DIMENSIONS)
+        metrics.gauge('TotalMemoryFree', memory.available, 'Bytes', CAMERA_DIMENSIONS)
+        metrics.gauge('MemoryUtilizationPercent', memory.percent, 'Percent', CAMERA_DIMENSIONS)
+        metrics.gauge('TotalCpuUtilization', cpu, 'Percent', CAMERA_DIMENSIONS)
+        metrics.gauge('DiskUtilizationPercent', disk.percent, 'Percent', CAMERA_DIMENSIONS)
     except Exception as e:
-        logger.error(f"Failed to emit metrics to CloudWatch: {e}")
+        logger.error(f"Failed to record CloudWatch metrics: {e}")
 
 def record_video():
     cap = cv2.VideoCapture(rtsp_url)
@@ -191,12 +124,23 @@ def record_video():
     cv2.destroyAllWindows()
     return True
 
+def handle_shutdown(signum, frame):
+    # Unwind main() so its finally block flushes buffered metrics
+    logger.info(f"Received signal {signum}, shutting down")
+    sys.exit(0)
+
 def main():
-    while True:
-        success = record_video()
-        if not success:
-            logger.info("Restarting camera stream...")
-            time.sleep(5)  # Wait a bit before trying again
+    signal.signal(signal.SIGTERM, handle_shutdown)
+    signal.signal(signal.SIGINT, handle_shutdown)
+    metrics.start()
+    try:
+        while True:
+            success = record_video()
+            if not success:
+                logger.info("Restarting camera stream...")
+                time.sleep(5)  # Wait a bit before trying again
+    finally:
+        metrics.close()
 
 if __name__ == "__main__":
     main()
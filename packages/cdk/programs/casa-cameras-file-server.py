@@ -1,10 +1,13 @@
 from flask import Flask, send_file, abort, request, jsonify, Response
 from datetime import datetime
 import os
+import sys
+import json
 import logging
 import time
 import re
 import mimetypes
+import sqlite3
 from flask_cors import CORS
 
 app = Flask(__name__)
@@ -14,16 +17,53 @@ CORS(app, expose_headers=['Accept-Ranges', 'Content-Range', 'Content-Length'])
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Configuration
-RAW_VIDEO_DIR = "/media/external/raw"
+# Configuration; the environment variables and __main__ options match casa-cameras-local-writer.py's
+RAW_VIDEO_DIR = os.environ.get('OUTPUT_DIR', "/media/external/raw")
+CAMERAS_FILE = os.environ.get('CAMERAS_FILE')  # The writer's --cameras file; None for the single default camera
+CATALOG_DB = os.environ.get('CATALOG_DB') or os.path.join(RAW_VIDEO_DIR, "catalog.db")  # Segment catalog maintained by the writer
+DEFAULT_CAMERA = "default"  # The single camera recorded straight into RAW_VIDEO_DIR when there is no cameras file
+CAMERA_DIRS = {DEFAULT_CAMERA: RAW_VIDEO_DIR}  # Camera name -> directory holding its YYYY/MM/DD/HH tree, set by configure()
 
 # Initialize server metrics
 app.request_count = 0
 app.start_time = time.time()
 
-# Check if base directory exists
-if not os.path.isdir(RAW_VIDEO_DIR):
-    logging.error(f"CRITICAL: Base video directory not found: {RAW_VIDEO_DIR}")
+def load_camera_dirs(cameras_file, raw_dir):
+    """
+    Resolves each camera's directory the way the writer's load_cameras does: a
+    cameras file entry uses its output_dir, or <raw_dir>/<name> if it has none.
+    Raises ValueError on a bad file.
+    """
+    if not cameras_file:
+        return {DEFAULT_CAMERA: raw_dir}
+    with open(cameras_file) as f:
+        entries = json.load(f)
+    if not isinstance(entries, list) or not entries:
+        raise ValueError("camera file must contain a non-empty JSON list")
+    camera_dirs = {}
+    for entry in entries:
+        name = entry.get("name", "") if isinstance(entry, dict) else ""
+        if not re.fullmatch(r'[A-Za-z0-9_-]+', name):
+            raise ValueError(f"invalid camera name {name!r}")
+        camera_dirs[name] = os.path.abspath(entry.get("output_dir") or os.path.join(raw_dir, name))
+    return camera_dirs
+
+def configure(raw_dir, cameras_file, catalog_db):
+    """Points the server at the writer's layout; exits if the cameras file can't be read."""
+    global RAW_VIDEO_DIR, CAMERAS_FILE, CATALOG_DB, CAMERA_DIRS
+    RAW_VIDEO_DIR = raw_dir
+    CAMERAS_FILE = cameras_file
+    CATALOG_DB = catalog_db or os.path.join(raw_dir, "catalog.db")
+    try:
+        CAMERA_DIRS = load_camera_dirs(cameras_file, raw_dir)
+    except (OSError, ValueError) as e:
+        logging.critical(f"Failed to load cameras from {cameras_file}: {e}")
+        sys.exit(1)
+    for camera, camera_dir in CAMERA_DIRS.items():
+        # Check that each camera's base directory exists
+        if not os.path.isdir(camera_dir):
+            logging.error(f"CRITICAL: Video directory for camera {camera} not found: {camera_dir}")
+    logging.info(f"Serving {len(CAMERA_DIRS)} camera(s) from {', '.join(CAMERA_DIRS.values())}; catalog {CATALOG_DB}")
 
 # Helper Functions
 def parse_date(date_str):
@@ -35,6 +75,18 @@ def parse_date(date_str):
     except ValueError:
         abort(400, description="Invalid date format. Expected YYYY-MM-DD.")
 
+def get_camera():
+    """
+    Returns (camera name, its base directory) from the optional 'camera' query
+    parameter; without one, the default camera or else the first configured one.
+    """
+    camera = request.args.get('camera') or (DEFAULT_CAMERA if DEFAULT_CAMERA in CAMERA_DIRS else next(iter(CAMERA_DIRS)))
+    if not re.fullmatch(r'[A-Za-z0-9_-]+', camera):
+        abort(400, description="Invalid camera name.")
+    if camera not in CAMERA_DIRS:
+        abort(404, description="Unknown camera.")
+    return camera, CAMERA_DIRS[camera]
+
 def validate_time_params(hour, minute):
     """Validate hour and minute parameters."""
     if hour is None or minute is None:
@@ -46,6 +98,20 @@ def validate_time_params(hour, minute):
         abort(400, description="Invalid hour or minute value.")
     return hour_int, minute_int
 
+def open_catalog():
+    """Read-only connection to the writer's segment catalog, or None if it is missing or not yet complete."""
+    if not os.path.isfile(CATALOG_DB):
+        return None
+    try:
+        conn = sqlite3.connect(f"file:{CATALOG_DB}?mode=ro", uri=True, timeout=2)
+        row = conn.execute("SELECT value FROM meta WHERE key = 'backfill_complete'").fetchone()
+        if row and row[0] == "1":
+            return conn
+        conn.close()
+    except sqlite3.Error as e:
+        logging.warning(f"Segment catalog unavailable, falling back to directory scans: {e}")
+    return None
+
 def get_cache_control(quality: str) -> str:
     """Get appropriate cache control based on quality/network."""
     if quality == 'high':
@@ -133,13 +199,16 @@ def index():
         "uptime": uptime_str,
         "base_directory": RAW_VIDEO_DIR,
         "directory_exists": os.path.isdir(RAW_VIDEO_DIR),
+        "cameras": {camera: os.path.isdir(camera_dir) for camera, camera_dir in CAMERA_DIRS.items()},
+        "catalog_exists": os.path.isfile(CATALOG_DB),
         "endpoints": {
             "/": "This information page",
             "/health": "Health check and server status",
             "/metrics": "Server performance metrics", 
             "/listAvailableDates": "Get available video dates",
             "/listAvailableTimes?date=YYYY-MM-DD": "Get available times for a date",
-            "/getRawVideo?date=YYYY-MM-DD&hour=HH&minute=MM": "Stream video file"
+            "/getRawVideo?date=YYYY-MM-DD&hour=HH&minute=MM": "Stream video file",
+            "camera=NAME": "Optional on the endpoints above, for multi-camera recorders"
         },
         "features": [
             "HTTP Range Requests (video seeking)",
@@ -162,10 +231,11 @@ def get_raw_video():
     # Validate inputs
     date = parse_date(date_str)
     hour, minute = validate_time_params(hour_str, minute_str)
+    _, camera_dir = get_camera()
     
     # Construct file path
     file_path = os.path.join(
-        RAW_VIDEO_DIR,
+        camera_dir,
         f"{date.year}",
         f"{date.month:02}",
         f"{date.day:02}",
@@ -198,10 +268,24 @@ def list_available_times():
     """
     date_str = request.args.get('date')
     date = parse_date(date_str)
+    camera, camera_dir = get_camera()
+    
+    # One indexed query when the writer's catalog is available
+    catalog = open_catalog()
+    if catalog:
+        try:
+            rows = catalog.execute("SELECT minute FROM segments WHERE camera = ? AND day = ? ORDER BY minute",
+                                   (camera, date.isoformat())).fetchall()
+            logging.info(f"Found {len(rows)} available video times for {date_str} in catalog.")
+            return jsonify([minute for (minute,) in rows])
+        except sqlite3.Error as e:
+            logging.warning(f"Catalog query failed, scanning directories instead: {e}")
+        finally:
+            catalog.close()
     
     # Construct the path to the directory for the given date
     date_dir = os.path.join(
-        RAW_VIDEO_DIR,
+        camera_dir,
         f"{date.year}",
         f"{date.month:02}",
         f"{date.day:02}"
@@ -246,13 +330,24 @@ def list_available_times():
 @app.route('/listAvailableDates')
 def list_available_dates():
     """Returns a list of available recording dates in YYYY-MM-DD format."""
+    camera, camera_dir = get_camera()
+    catalog = open_catalog()
+    if catalog:
+        try:
+            rows = catalog.execute("SELECT DISTINCT day FROM segments WHERE camera = ? ORDER BY day DESC", (camera,)).fetchall()
+            return jsonify([day for (day,) in rows])
+        except sqlite3.Error as e:
+            logging.warning(f"Catalog query failed, scanning directories instead: {e}")
+        finally:
+            catalog.close()
+    
     dates = []
     try:
         # Traverse year/month/day directory structure
-        for year in sorted(os.listdir(RAW_VIDEO_DIR), reverse=True):
+        for year in sorted(os.listdir(camera_dir), reverse=True):
             if not year.isdigit():
                 continue
-            year_dir = os.path.join(RAW_VIDEO_DIR, year)
+            year_dir = os.path.join(camera_dir, year)
             if not os.path.isdir(year_dir):
                 continue
             for month in sorted(os.listdir(year_dir), reverse=True):
@@ -358,7 +453,14 @@ if __name__ == '__main__':
     parser.add_argument('--https', action='store_true', help='Enable HTTPS with self-signed certificate')
     parser.add_argument('--cert', type=str, help='Path to SSL certificate file')
     parser.add_argument('--key', type=str, help='Path to SSL private key file')
+    parser.add_argument('--output-dir', default=RAW_VIDEO_DIR,
+                        help='Directory the writer records into (default: $OUTPUT_DIR or /media/external/raw)')
+    parser.add_argument('--cameras', default=CAMERAS_FILE,
+                        help="The writer's cameras JSON file, to find each camera's output_dir (default: $CAMERAS_FILE)")
+    parser.add_argument('--catalog-db', default=os.environ.get('CATALOG_DB'),
+                        help='Path of the writer\'s segment catalog (default: $CATALOG_DB or <output-dir>/catalog.db)')
     args = parser.parse_args()
+    configure(args.output_dir, args.cameras, args.catalog_db)
     
     logging.info("Starting Enhanced Casa Cameras File Server v2.0.0")
     logging.info("Features: HTTP Range support, Quality adaptation, Enhanced CORS")
@@ -1,4 +1,3 @@
-import RPi.GPIO as GPIO
 import logging
 from logging import handlers
 import json
@@ -7,30 +6,247 @@ import time
 import websocket
 import threading
 import boto3
+from botocore.exceptions import ClientError, ParamValidationError
 from datetime import datetime, timedelta
 import pytz
 import uuid
+import queue
+import random
+import struct
+import bisect
+from collections import OrderedDict
+import argparse
+import tempfile
 
 # Configuration Constants
-HOME_ID = "720frontrd"  # Configurable home identifier
 INSTANCE_ID = str(uuid.uuid4())[:8]  # Generate a unique ID for this instance
 
-# GPIO Pin Definitions
-PIN_DOOR = 4  # Door sensor
-PIN_MOTION = 13  # Motion sensor
-PIN_ZONE_3 = 26
-PIN_ZONE_4 = 19  # Basement Window
-PIN_ZONE_5 = 6   # Office Window
-PIN_ZONE_6 = 27
-PIN_ZONE_7 = 17  # Rear Window
-PIN_ZONE_8 = 22  # Attic Door
-PIN_SIREN = 23
-
-# Set up GPIO
-GPIO.setmode(GPIO.BCM)
-GPIO.setup([PIN_DOOR, PIN_MOTION, PIN_ZONE_3, PIN_ZONE_4, PIN_ZONE_5,
-            PIN_ZONE_6, PIN_ZONE_7, PIN_ZONE_8], GPIO.IN, pull_up_down=GPIO.PUD_UP)
-GPIO.setup(PIN_SIREN, GPIO.OUT)
+# Site layout (home id, panels, zones, siren pins, auto-arm rules). The file has
+# the same shape as DEFAULT_SITE_CONFIG; without it this Pi's original layout is used.
+SITE_CONFIG_FILE = os.environ.get('CASA_CONFIG_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), "casa-config.json"))
+DEFAULT_AUTO_ARM_SCHEDULE = {
+    "timezone": "US/Eastern",
+    "windows": [
+        # Armed overnight; disarm at the end if still in the auto-armed mode
+        {"arm": "02:30", "disarm": "05:30", "mode": "Arm Stay", "disarmGraceMinutes": 30},
+    ],
+}
+DEFAULT_SITE_CONFIG = {
+    "homeId": "720frontrd",
+    "panels": [
+        {
+            "id": "main",
+            "sirenPin": 23,
+            "zones": [
+                {"name": "Front Door", "pin": 4},
+                {"name": "MOTION", "pin": 13, "type": "motion"},
+                {"name": "ZONE 3", "pin": 26},
+                {"name": "Basement Window", "pin": 19},
+                {"name": "Office Window", "pin": 6},
+                {"name": "ZONE 6", "pin": 27},
+                {"name": "Rear Lower Windows", "pin": 17},
+                {"name": "Attic Door", "pin": 22},
+            ],
+        },
+    ],
+    "autoArm": DEFAULT_AUTO_ARM_SCHEDULE,
+}
+
+# Zone monitoring
+DEFAULT_DEBOUNCE_MS = 50  # Ignore contact chatter shorter than this
+ZONE_RESYNC_INTERVAL = 5  # Seconds between safety re-reads of all zones
+# Modes in which an opened zone of each sensor type sounds the siren (overridable per zone with "armModes")
+SENSOR_ARM_MODES = {
+    "contact": ["Arm Stay", "Arm Away"],
+    "motion": ["Arm Away"],
+}
+
+
+class Zone:
+    """A monitored input: static wiring from the site config plus its debounced state."""
+
+    def __init__(self, zone_id, name, pin, panel, sensor_type="contact", debounce_ms=DEFAULT_DEBOUNCE_MS, arm_modes=None):
+        self.id = zone_id  # Stable numeric id used in the event journal
+        self.name = name
+        self.pin = pin
+        self.panel = panel
+        self.sensor_type = sensor_type  # "contact" (door/window) or "motion"
+        self.debounce = debounce_ms / 1000.0
+        self.arm_modes = arm_modes if arm_modes is not None else SENSOR_ARM_MODES[sensor_type]
+        self.state = None  # Last accepted GPIO level
+        self.last_change = 0.0  # time.monotonic() of the last accepted change
+        self.recheck_at = None  # Pending re-read once the debounce window closes
+
+
+class RPiGPIOBackend:
+    """The Pi's on-board header via RPi.GPIO, imported lazily so the module loads off a Pi."""
+
+    def __init__(self):
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        GPIO.setmode(GPIO.BCM)
+
+    def setup_inputs(self, pins):
+        self.GPIO.setup(pins, self.GPIO.IN, pull_up_down=self.GPIO.PUD_UP)
+
+    def setup_output(self, pin):
+        self.GPIO.setup(pin, self.GPIO.OUT)
+
+    def watch(self, pin, callback):
+        self.GPIO.add_event_detect(pin, self.GPIO.BOTH, callback=callback)
+
+    def read(self, pin):
+        return self.GPIO.input(pin)
+
+    def write(self, pin, high):
+        self.GPIO.output(pin, self.GPIO.HIGH if high else self.GPIO.LOW)
+
+    def cleanup(self):
+        self.GPIO.cleanup()
+
+
+class SimulatedGPIOBackend:
+    """
+    In-memory board for running and benchmarking the alarm logic off a Pi.
+    set_input() changes a pin level and fires its edge callback on the calling
+    thread, the way RPi.GPIO fires callbacks from its event thread.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.levels = {}
+        self.callbacks = {}
+
+    def setup_inputs(self, pins):
+        with self.lock:
+            for pin in pins:
+                self.levels.setdefault(pin, 0)
+
+    def setup_output(self, pin):
+        with self.lock:
+            self.levels.setdefault(pin, 0)
+
+    def watch(self, pin, callback):
+        self.callbacks[pin] = callback
+
+    def read(self, pin):
+        return self.levels.get(pin, 0)
+
+    def write(self, pin, high):
+        self.levels[pin] = 1 if high else 0
+
+    def set_input(self, pin, level):
+        with self.lock:
+            changed = self.levels.get(pin) != level
+            self.levels[pin] = level
+        callback = self.callbacks.get(pin)
+        if changed and callback:
+            callback(pin)
+
+    def cleanup(self):
+        self.callbacks.clear()
+
+
+GPIO_BACKENDS = {
+    "rpi": RPiGPIOBackend,
+    "sim": SimulatedGPIOBackend,
+}
+gpio_backends = {}  # One shared instance per backend name
+
+def get_gpio_backend(name):
+    if name not in gpio_backends:
+        if name not in GPIO_BACKENDS:
+            raise ValueError(f"Unknown GPIO backend '{name}' (expected one of {', '.join(GPIO_BACKENDS)})")
+        gpio_backends[name] = GPIO_BACKENDS[name]()
+    return gpio_backends[name]
+
+
+class Panel:
+    """A board of zone inputs with an optional siren output, driven through a GPIO backend."""
+
+    def __init__(self, panel_id, backend, siren_pin=None):
+        self.id = panel_id
+        self.backend = backend
+        self.siren_pin = siren_pin
+        self.zones = []
+        self.zones_by_pin = {}
+
+    def add_zone(self, zone):
+        if zone.pin in self.zones_by_pin:
+            raise ValueError(f"Panel {self.id}: pin {zone.pin} is used by both {self.zones_by_pin[zone.pin].name} and {zone.name}")
+        self.zones.append(zone)
+        self.zones_by_pin[zone.pin] = zone
+
+    def setup(self):
+        self.backend.setup_inputs([zone.pin for zone in self.zones])
+        if self.siren_pin is not None:
+            self.backend.setup_output(self.siren_pin)
+
+    def start(self):
+        for zone in self.zones:
+            zone.state = self.read(zone)
+            self.backend.watch(zone.pin, self.on_edge)
+
+    def on_edge(self, pin):
+        """GPIO edge callback: hand the edge to the dispatcher without doing any work here."""
+        zone_events.put((self.zones_by_pin[pin], time.monotonic()))
+
+    def read(self, zone):
+        return self.backend.read(zone.pin)
+
+    def set_siren(self, on):
+        if self.siren_pin is not None:
+            self.backend.write(self.siren_pin, on)
+
+
+def build_panels(site_config, backend_override=None):
+    """
+    Turn the panels section of the site config into Panel/Zone objects with unique
+    zone ids. Panels on the same backend share its pins, so every zone and siren
+    pin must be unique per backend across all panels.
+    """
+    panels = []
+    zone_ids = set()
+    next_zone_id = 0
+    pin_owners = {}  # (backend name, pin) -> what uses it
+
+    def claim_pin(backend_name, pin, owner):
+        if (backend_name, pin) in pin_owners:
+            raise ValueError(f"Pin {pin} on the {backend_name} backend is used by both {pin_owners[backend_name, pin]} and {owner}")
+        pin_owners[backend_name, pin] = owner
+
+    for panel_config in site_config["panels"]:
+        backend_name = backend_override or panel_config.get("backend", "rpi")
+        backend = get_gpio_backend(backend_name)
+        panel = Panel(panel_config["id"], backend, panel_config.get("sirenPin"))
+        if panel.siren_pin is not None:
+            claim_pin(backend_name, panel.siren_pin, f"the siren of panel {panel.id}")
+        for zone_config in panel_config["zones"]:
+            zone_id = zone_config.get("id", next_zone_id)
+            # Zone ids are stored as 16-bit fields in the event journal, where 0xFFFF means "system"
+            if isinstance(zone_id, bool) or not isinstance(zone_id, int) or not 0 <= zone_id < JOURNAL_SYSTEM_ZONE:
+                raise ValueError(f"Zone id {zone_id!r} ({zone_config['name']}) must be an integer from 0 to {JOURNAL_SYSTEM_ZONE - 1}")
+            if zone_id in zone_ids:
+                raise ValueError(f"Duplicate zone id {zone_id} ({zone_config['name']})")
+            zone_ids.add(zone_id)
+            next_zone_id = max(next_zone_id, zone_id) + 1
+            claim_pin(backend_name, zone_config["pin"], f"zone {zone_config['name']} on panel {panel.id}")
+            panel.add_zone(Zone(
+                zone_id,
+                zone_config["name"],
+                zone_config["pin"],
+                panel,
+                sensor_type=zone_config.get("type", "contact"),
+                debounce_ms=zone_config.get("debounceMs", DEFAULT_DEBOUNCE_MS),
+                arm_modes=zone_config.get("armModes"),
+            ))
+        panels.append(panel)
+    return panels
+
+
+# Edge callbacks run on the GPIO backend's event thread and only enqueue; the
+# dispatcher in the main loop is the single consumer for every panel.
+zone_events = queue.Queue()
 
 # Create the logs directory if it doesn't exist
 logs_dir = "/tmp/logs"
@@ -48,91 +264,945 @@ formatter = logging.Formatter('%(asctime)s - %(message)s')
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 
+def load_site_config(path):
+    if not os.path.exists(path):
+        logger.info(f"No site config at {path}, using built-in layout")
+        return DEFAULT_SITE_CONFIG
+    with open(path) as config_file:
+        site_config = json.load(config_file)
+    logger.info(f"Loaded site config from {path}")
+    return site_config
+
+SITE_CONFIG = load_site_config(SITE_CONFIG_FILE)
+HOME_ID = SITE_CONFIG.get("homeId", DEFAULT_SITE_CONFIG["homeId"])
+# Filled in by setup_panels() from main() or run_benchmark(), so importing this
+# module (or running --benchmark) never touches RPi.GPIO
+PANELS = []
+ZONES = []
+ZONES_BY_ID = {}
+
+def setup_panels(site_config, backend_override=None):
+    global PANELS, ZONES, ZONES_BY_ID
+    PANELS = build_panels(site_config, backend_override)
+    ZONES = [zone for panel in PANELS for zone in panel.zones]
+    ZONES_BY_ID = {zone.id: zone for zone in ZONES}
+
 # AWS Credentials and Setup
 aws_access_key_id = os.environ.get('AWS_ACCESS_KEY_ID')
 aws_secret_access_key = os.environ.get('AWS_SECRET_ACCESS_KEY')
 region_name = 'us-east-1'
 dynamodb = boto3.resource('dynamodb', aws_access_key_id=aws_access_key_id,
                           aws_secret_access_key=aws_secret_access_key, region_name=region_name)
-event_logs_table = dynamodb.Table('EventLogs')
+EVENT_LOGS_TABLE = 'EventLogs'
+ALARM_STATE_TABLE = 'AlarmState'
+
+# Table handles are created once and reused; boto3 resources are safe to share
+# across threads for plain item operations.
+table_cache = {}
+
+def get_table(name):
+    table = table_cache.get(name)
+    if table is None:
+        table = table_cache[name] = dynamodb.Table(name)
+    return table
+
+# Event pipeline
+EVENT_QUEUE_SIZE = 1000  # Events held in memory before new ones are dropped
+EVENT_BATCH_SIZE = 25  # DynamoDB batch_write_item limit
+EVENT_BATCH_WAIT = 0.2  # Seconds to wait for more events before flushing a partial batch
+EVENT_MAX_RETRIES = 5
+EVENT_RETRY_BASE_DELAY = 0.5  # Seconds, doubled per retry with jitter
+# Kept next to the script rather than in /tmp so spooled events survive a reboot
+EVENT_SPOOL_FILE = os.environ.get('EVENT_SPOOL_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), "event-spool.jsonl"))
+EVENT_SPOOL_MAX_BYTES = 50 * 1024 * 1024
+# Events DynamoDB refuses outright (validation errors, bad keys) are set aside here so they don't block the spool
+EVENT_REJECT_FILE = os.environ.get('EVENT_REJECT_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), "event-rejects.jsonl"))
+# Error codes worth retrying; any other ClientError means the request itself is bad
+EVENT_RETRYABLE_ERROR_CODES = {
+    "ProvisionedThroughputExceededException",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+    "InternalServerError",
+    "ServiceUnavailable",
+}
+EVENT_SPOOL_REPLAY_INTERVAL = 30  # Seconds between replay attempts while the spool is non-empty
+EVENT_STATS_INTERVAL = 300  # Seconds between pipeline stats log lines
+
+
+class EventSink:
+    """
+    Background event writer. Callers only enqueue; a worker thread coalesces
+    events into batch_write_item calls.
+    Batches that cannot be written after retries are appended to a local spool
+    file, and while the spool is non-empty new batches go behind it so events
+    reach DynamoDB in the order they happened.
+    """
+
+    def __init__(self, table_name, spool_path):
+        self.table_name = table_name
+        self.spool_path = spool_path
+        self.queue = queue.Queue(maxsize=EVENT_QUEUE_SIZE)
+        self.stop_event = threading.Event()
+        self.stats_lock = threading.Lock()
+        self.counters = {
+            "enqueued": 0,
+            "written": 0,
+            "dropped": 0,
+            "spooled": 0,
+            "replayed": 0,
+            "failedBatches": 0,
+            "rejected": 0,
+        }
+        self.flush_count = 0
+        self.flush_total_ms = 0.0
+        self.flush_max_ms = 0.0
+        self.last_flush_ms = None
+        self.thread = threading.Thread(target=self._run, name="EventSink", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def close(self, timeout=10):
+        """Stop accepting work and give the worker a chance to flush or spool what is queued."""
+        self.stop_event.set()
+        self.thread.join(timeout)
+
+    def submit(self, event_data):
+        try:
+            self.queue.put_nowait(event_data)
+            self._count("enqueued")
+        except queue.Full:
+            self._count("dropped")
+            logger.error(f"Event queue full, dropping event: {event_data['event']}")
+
+    def stats(self):
+        with self.stats_lock:
+            stats = dict(self.counters)
+            stats["queueDepth"] = self.queue.qsize()
+            stats["spoolBytes"] = self._spool_size()
+            stats["lastFlushMs"] = self.last_flush_ms
+            stats["maxFlushMs"] = self.flush_max_ms
+            stats["avgFlushMs"] = self.flush_total_ms / self.flush_count if self.flush_count else None
+        return stats
+
+    def _count(self, name, amount=1):
+        with self.stats_lock:
+            self.counters[name] += amount
+
+    def _run(self):
+        last_replay = 0.0
+        last_stats = time.monotonic()
+        while not (self.stop_event.is_set() and self.queue.empty()):
+            batch = self._collect_batch()
+            if batch:
+                self._flush(batch)
+
+            now = time.monotonic()
+            if self._spool_size() and now - last_replay >= EVENT_SPOOL_REPLAY_INTERVAL:
+                last_replay = now
+                self._replay_spool()
+            if now - last_stats >= EVENT_STATS_INTERVAL:
+                last_stats = now
+                logger.info(f"Event pipeline stats: {json.dumps(self.stats())}")
+
+    def _collect_batch(self):
+        """Block for the first event, then take whatever else arrives within EVENT_BATCH_WAIT."""
+        batch = []
+        try:
+            event_data = self.queue.get(timeout=1)
+        except queue.Empty:
+            return batch
+        deadline = time.monotonic() + EVENT_BATCH_WAIT
+        while True:
+            batch.append(event_data)
+            remaining = deadline - time.monotonic()
+            if len(batch) >= EVENT_BATCH_SIZE or remaining <= 0:
+                break
+            try:
+                event_data = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch):
+        if self._spool_size():
+            # Keep ordering: anything newer waits behind the spooled backlog
+            self._spool(batch)
+            return
+        unwritten = self._write_batch(batch)
+        if unwritten:
+            self._spool(unwritten)
+
+    def _write_batch(self, items):
+        """
+        Write items with retry/backoff. Returns the items that could not be written and
+        are worth trying again later; items DynamoDB rejects outright go to the reject file.
+        """
+        requests = [{"PutRequest": {"Item": item}} for item in items]
+        delay = EVENT_RETRY_BASE_DELAY
+        start = time.monotonic()
+        for attempt in range(EVENT_MAX_RETRIES):
+            try:
+                response = dynamodb.batch_write_item(RequestItems={self.table_name: requests})
+                requests = response.get("UnprocessedItems", {}).get(self.table_name, [])
+                if not requests:
+                    self._record_flush(len(items), (time.monotonic() - start) * 1000)
+                    return []
+                logger.warning(f"{len(requests)} events unprocessed by DynamoDB (attempt {attempt + 1}/{EVENT_MAX_RETRIES})")
+            except Exception as e:
+                if not is_retryable_write_error(e):
+                    pending = [request["PutRequest"]["Item"] for request in requests]
+                    self._count("written", len(items) - len(pending))
+                    return self._isolate_rejects(pending, e)
+                logger.error(f"Failed to write event batch to DynamoDB (attempt {attempt + 1}/{EVENT_MAX_RETRIES}): {e}")
+            if self.stop_event.is_set():
+                break
+            time.sleep(delay + random.uniform(0, delay))
+            delay *= 2
+        self._count("failedBatches")
+        unwritten = [request["PutRequest"]["Item"] for request in requests]
+        self._count("written", len(items) - len(unwritten))
+        return unwritten
+
+    def _isolate_rejects(self, items, error):
+        """
+        A non-retryable error fails the whole request, so resend the items one at a time
+        to find the ones at fault. Stops at the first retryable failure and returns it
+        with everything after it, so the caller keeps them in order.
+        """
+        if len(items) == 1:
+            self._reject(items[0], error)
+            return []
+        for index, item in enumerate(items):
+            unwritten = self._write_batch([item])
+            if unwritten:
+                return unwritten + items[index + 1:]
+        return []
+
+    def _reject(self, item, error):
+        self._count("rejected")
+        logger.error(f"DynamoDB rejected event {item.get('id') if isinstance(item, dict) else item}, setting it aside: {error}")
+        try:
+            if os.path.exists(EVENT_REJECT_FILE) and os.path.getsize(EVENT_REJECT_FILE) >= EVENT_SPOOL_MAX_BYTES:
+                return
+            with open(EVENT_REJECT_FILE, "a") as rejects:
+                rejects.write(json.dumps({"item": item, "error": str(error)}, default=str) + "\n")
+        except OSError as e:
+            logger.error(f"Failed to write rejected event: {e}")
+
+    def _record_flush(self, count, elapsed_ms):
+        with self.stats_lock:
+            self.counters["written"] += count
+            self.flush_count += 1
+            self.flush_total_ms += elapsed_ms
+            self.flush_max_ms = max(self.flush_max_ms, elapsed_ms)
+            self.last_flush_ms = elapsed_ms
+
+    def _spool_size(self):
+        try:
+            return os.path.getsize(self.spool_path)
+        except OSError:
+            return 0
+
+    def _spool(self, items):
+        if self._spool_size() >= EVENT_SPOOL_MAX_BYTES:
+            self._count("dropped", len(items))
+            logger.error(f"Event spool full, dropping {len(items)} events")
+            return
+        try:
+            with open(self.spool_path, "a") as spool:
+                for item in items:
+                    spool.write(json.dumps(item) + "\n")
+                spool.flush()
+                os.fsync(spool.fileno())
+            self._count("spooled", len(items))
+            logger.warning(f"Spooled {len(items)} events to {self.spool_path}")
+        except OSError as e:
+            self._count("dropped", len(items))
+            logger.error(f"Failed to spool events: {e}")
+
+    def _replay_spool(self):
+        """Send spooled events oldest first; whatever is left after a failure is written back."""
+        items = []
+        try:
+            with open(self.spool_path) as spool:
+                for line in spool:
+                    if not line.strip():
+                        continue
+                    try:
+                        items.append(json.loads(line))
+                    except ValueError as e:
+                        # A torn or corrupt line would otherwise stop the replay for good
+                        self._reject(line.rstrip("\n"), e)
+        except OSError as e:
+            logger.error(f"Failed to read event spool: {e}")
+            return
+
+        sent = 0
+        index = 0
+        remaining = []
+        while index < len(items):
+            batch = items[index:index + EVENT_BATCH_SIZE]
+            index += len(batch)
+            unwritten = self._write_batch(batch)
+            sent += len(batch) - len(unwritten)
+            if unwritten:
+                # Unprocessed items aren't necessarily the tail of the batch
+                remaining = unwritten + items[index:]
+                break
+        self._count("replayed", sent)
+
+        try:
+            if remaining:
+                temp_path = self.spool_path + ".tmp"
+                with open(temp_path, "w") as spool:
+                    for item in remaining:
+                        spool.write(json.dumps(item) + "\n")
+                    spool.flush()
+                    os.fsync(spool.fileno())
+                os.replace(temp_path, self.spool_path)
+            else:
+                os.remove(self.spool_path)
+        except OSError as e:
+            logger.error(f"Failed to rewrite event spool: {e}")
+        if sent:
+            logger.info(f"Replayed {sent} spooled events, {len(remaining)} remaining")
+
+
+def is_retryable_write_error(error):
+    """Throttling, server-side and network errors are retried; a malformed request never succeeds."""
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code") in EVENT_RETRYABLE_ERROR_CODES
+    # ParamValidationError/TypeError come from boto3 refusing to serialize the item
+    return not isinstance(error, (ParamValidationError, TypeError, ValueError))
+
+
+event_sink = EventSink(EVENT_LOGS_TABLE, EVENT_SPOOL_FILE)
 
 # Setup WebSocket
 ws_url = 'wss://w42qpgs203.execute-api.us-east-1.amazonaws.com/prod'
-MAX_RECONNECT_ATTEMPTS = 10
-RECONNECT_EXPONENTIAL_BACKOFF = 2
 RECONNECT_MIN_WAIT = 1  # Minimum wait time in seconds
-ws = None
-ws_connected_event = threading.Event()
+RECONNECT_MAX_WAIT = 60  # Cap for the exponential backoff window
+WS_PING_INTERVAL = 30  # Seconds between keepalive pings
+WS_PING_TIMEOUT = 10  # Seconds without a pong before the link is considered dead
+WS_SEND_QUEUE_SIZE = 500  # Outbound messages held while disconnected; oldest dropped first
 
 system_mode = "Disarm"  # Disarm, Arm Stay, Arm Away
 system_connected = False
+# Guards system_mode and the override globals; held by the command worker and auto-arm
+mode_lock = threading.RLock()
 
 # Variables for auto arm override logic
 last_arm_was_auto = False
 manual_override = False
-manual_override_until = None
+manual_override_until = None  # Epoch seconds
 MANUAL_OVERRIDE_TTL_MINUTES = 30
 
-def update_alarm_state_in_db():
-    """Update the AlarmState table with the current system mode"""
-    try:
-        alarm_state_table = dynamodb.Table('AlarmState')
-        alarm_state_item = {
-            "id": HOME_ID,
-            "mode": system_mode,
-            "lastUpdated": datetime.utcnow().isoformat(),
+# Auto-arm schedule: the "autoArm" section of the site config, re-read when the file
+# changes so windows can be edited without a restart
+SCHEDULE_FILE_CHECK_INTERVAL = 300  # Seconds between checks for an edited schedule file
+
+
+class AutoArmSchedule:
+    """
+    Precomputed auto-arm transitions. Rule windows are resolved to absolute
+    epoch instants (DST-aware) once per local day, and next_check holds the
+    next instant anything can change, so the caller's hot path is a single
+    integer comparison. Setting next_check to 0 forces a re-evaluation, which
+    callers do whenever the system mode changes outside the schedule.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file_mtime = None
+        self.tz = None
+        self.windows = []
+        self.intervals = []  # (arm_ts, disarm_ts, grace_end_ts, mode) covering yesterday..tomorrow
+        self.rebuild_at = 0
+        self.file_check_at = 0
+        self.next_check = 0
+
+    def load(self):
+        """
+        Read the schedule file. A file that can't be read or parsed never replaces a
+        schedule already in force: the error is logged and the previous windows and
+        timezone stay. Defaults are used only when there is nothing to keep.
+        """
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        self.file_mtime = mtime
+        try:
+            config = DEFAULT_AUTO_ARM_SCHEDULE
+            if mtime is not None:
+                with open(self.path) as schedule_file:
+                    config = json.load(schedule_file).get("autoArm", DEFAULT_AUTO_ARM_SCHEDULE)
+            tz, windows = self.parse(config)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError, pytz.UnknownTimeZoneError) as e:
+            if self.tz is not None:
+                logger.error(f"Invalid auto-arm schedule {self.path}, keeping the current one: {e}")
+                return
+            logger.error(f"Invalid auto-arm schedule {self.path}, using defaults: {e}")
+            tz, windows = self.parse(DEFAULT_AUTO_ARM_SCHEDULE)
+        else:
+            if mtime is not None:
+                logger.info(f"Loaded auto-arm schedule from {self.path}")
+        self.tz = tz
+        self.windows = windows
+        self.rebuild_at = 0
+
+    @staticmethod
+    def parse(config):
+        """(timezone, windows) from an "autoArm" section; raises on any malformed value."""
+        tz = pytz.timezone(config.get("timezone", DEFAULT_AUTO_ARM_SCHEDULE["timezone"]))
+        windows = []
+        for window in config.get("windows", []):
+            windows.append((
+                datetime.strptime(window["arm"], "%H:%M").time(),
+                datetime.strptime(window["disarm"], "%H:%M").time(),
+                window.get("mode", "Arm Stay"),
+                int(window.get("disarmGraceMinutes", 0)) * 60,
+            ))
+        return tz, windows
+
+    def refresh(self, now):
+        """Reload rules if the file changed and recompute instants when the local day rolls over."""
+        if now >= self.file_check_at:
+            self.file_check_at = now + SCHEDULE_FILE_CHECK_INTERVAL
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                mtime = None
+            if self.tz is None or mtime != self.file_mtime:
+                self.load()
+        if now >= self.rebuild_at:
+            self._build(now)
+
+    def _localize(self, day, at):
+        # Non-existent (spring-forward) times resolve to the standard-time reading
+        return int(self.tz.normalize(self.tz.localize(datetime.combine(day, at))).timestamp())
+
+    def _build(self, now):
+        today = datetime.fromtimestamp(now, self.tz).date()
+        self.intervals = []
+        for offset in (-1, 0, 1):
+            day = today + timedelta(days=offset)
+            for arm_at, disarm_at, mode, grace in self.windows:
+                arm_ts = self._localize(day, arm_at)
+                disarm_day = day if disarm_at > arm_at else day + timedelta(days=1)
+                disarm_ts = self._localize(disarm_day, disarm_at)
+                self.intervals.append((arm_ts, disarm_ts, disarm_ts + grace, mode))
+        self.intervals.sort()
+        self.rebuild_at = self._localize(today + timedelta(days=1), datetime.min.time())
+        logger.info(f"Auto-arm schedule built for {today}: {len(self.windows)} window(s)")
+
+    def armed_window(self, now):
+        """Mode to enforce if `now` is inside an arm window, else None."""
+        for arm_ts, disarm_ts, _, mode in self.intervals:
+            if arm_ts <= now < disarm_ts:
+                return mode
+        return None
+
+    def disarm_window(self, now):
+        """Mode that should be auto-disarmed if `now` is inside a post-window grace period, else None."""
+        for _, disarm_ts, grace_end_ts, mode in self.intervals:
+            if disarm_ts <= now < grace_end_ts:
+                return mode
+        return None
+
+    def next_transition(self, now):
+        instants = [ts for interval in self.intervals for ts in interval[:3] if ts > now]
+        instants.extend([self.rebuild_at, self.file_check_at])
+        return min(instants)
+
+
+auto_arm_schedule = AutoArmSchedule(SITE_CONFIG_FILE)
+
+# AlarmState write-behind
+ALARM_STATE_WRITE_DELAY = 1.0  # Seconds of quiet before the latest state is written
+ALARM_STATE_MAX_DELAY = 5.0  # Upper bound on how long continuous flapping can defer a write
+ALARM_STATE_RETRY_DELAY = 5.0  # Seconds before retrying a failed write
+
+
+class AlarmStateStore:
+    """
+    Authoritative in-memory copy of this home's AlarmState row.
+
+    update() only touches memory and is safe to call from any thread, and
+    snapshot() is the local read path used to answer state queries. A writer
+    thread persists the latest snapshot once updates go quiet, so a burst of
+    mode or connection flaps becomes a single write. Every change bumps a
+    version number and the write is conditional on the stored version being
+    older, so a delayed write can never clobber a newer state.
+    """
+
+    def __init__(self, home_id, table_name):
+        self.table_name = table_name
+        self.lock = threading.Lock()
+        self.state = {
+            "id": home_id,
+            "mode": "Disarm",
+            "connected": False,
             "instanceId": INSTANCE_ID,
-            "connected": system_connected
+            "lastUpdated": datetime.utcnow().isoformat(),
+            # Seeded from the clock so a restarted instance outranks what it wrote before
+            "version": int(time.time() * 1000),
         }
-        alarm_state_table.put_item(Item=alarm_state_item)
-        logger.info(f"Updated AlarmState in DB to {system_mode}, connected={system_connected}")
-    except Exception as e:
-        logger.error(f"Failed to update alarm state in DB: {e}")
+        self.dirty = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="AlarmStateWriter", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def close(self, timeout=5):
+        self.stop_event.set()
+        self.thread.join(timeout)
+
+    def update(self, **changes):
+        with self.lock:
+            self.state.update(changes)
+            self.state["version"] = max(self.state["version"] + 1, int(time.time() * 1000))
+            self.state["lastUpdated"] = datetime.utcnow().isoformat()
+        self.dirty.set()
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.state)
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            if not self.dirty.wait(1):
+                continue
+            self.dirty.clear()
+
+            # Debounce: keep deferring while updates keep arriving, up to the max delay
+            deadline = time.monotonic() + ALARM_STATE_MAX_DELAY
+            while time.monotonic() < deadline and not self.stop_event.wait(ALARM_STATE_WRITE_DELAY):
+                if not self.dirty.is_set():
+                    break
+                self.dirty.clear()
+
+            if not self._write(self.snapshot()):
+                self.dirty.set()
+                self.stop_event.wait(ALARM_STATE_RETRY_DELAY)
+
+        # Flush whatever changed since the last write before exiting
+        if self.dirty.is_set():
+            self._write(self.snapshot())
+
+    def _write(self, item):
+        try:
+            get_table(self.table_name).put_item(
+                Item=item,
+                ConditionExpression="attribute_not_exists(version) OR version < :version",
+                ExpressionAttributeValues={":version": item["version"]},
+            )
+            logger.info(f"Updated AlarmState in DB to {item['mode']}, connected={item['connected']}, version={item['version']}")
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException":
+                logger.warning(f"AlarmState in DB is newer than version {item['version']}, skipping write")
+                return True
+            logger.error(f"Failed to update alarm state in DB: {e}")
+        except Exception as e:
+            logger.error(f"Failed to update alarm state in DB: {e}")
+        return False
+
 
-def trigger_alarm():
-    log_event("ALARM triggered")
-    GPIO.output(PIN_SIREN, GPIO.HIGH)
+alarm_state = AlarmStateStore(HOME_ID, ALARM_STATE_TABLE)
+
+# Local event journal
+JOURNAL_DIR = os.environ.get('EVENT_JOURNAL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), "event-journal"))
+JOURNAL_RETENTION_DAYS = 90
+JOURNAL_RECORD = struct.Struct("<dHBB")  # timestamp, zone id, state, mode (12 bytes)
+JOURNAL_INDEX_ENTRY = struct.Struct("<II")  # epoch minute, first record number in that minute
+JOURNAL_READ_CHUNK = 4096  # Records read per disk read when scanning
+JOURNAL_SYSTEM_ZONE = 0xFFFF  # Zone id for events not tied to a zone (alarm, mode change)
+JOURNAL_STATES = ["closed", "opened", "alarm", "mode"]
+JOURNAL_STATE_CLOSED, JOURNAL_STATE_OPENED, JOURNAL_STATE_ALARM, JOURNAL_STATE_MODE = range(4)
+JOURNAL_MODES = ["Disarm", "Arm Stay", "Arm Away"]
+JOURNAL_DEFAULT_HISTORY_SECONDS = 24 * 60 * 60
+JOURNAL_MAX_QUERY_RESULTS = 1000
+JOURNAL_MAX_FUTURE_SECONDS = 24 * 60 * 60  # Tolerated clock skew for a requested start/end
+
+
+class EventJournal:
+    """
+    Append-only binary journal of zone and system events, one file per UTC day.
+
+    Each <YYYYMMDD>.bin holds fixed-size records in time order; the matching
+    .idx holds one entry per minute that has events, pointing at the first
+    record of that minute. A query loads the (small) index, bisects to the
+    first relevant record and reads forward, so history is answered from
+    local disk without scanning text logs or reading DynamoDB.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.day = None
+        self.data_file = None
+        self.index_file = None
+        self.record_count = 0
+        self.last_indexed_minute = -1
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, zone_id, state, mode, timestamp=None):
+        mode_code = JOURNAL_MODES.index(mode) if mode in JOURNAL_MODES else 0xFF
+        try:
+            with self.lock:
+                # Stamped under the lock so records land in the file in time order
+                timestamp = time.time() if timestamp is None else timestamp
+                minute = int(timestamp // 60)
+                self._open_day(time.strftime("%Y%m%d", time.gmtime(timestamp)))
+                self.data_file.write(JOURNAL_RECORD.pack(timestamp, zone_id, state, mode_code))
+                if minute > self.last_indexed_minute:
+                    self.index_file.write(JOURNAL_INDEX_ENTRY.pack(minute, self.record_count))
+                    self.last_indexed_minute = minute
+                self.record_count += 1
+        except OSError as e:
+            logger.error(f"Failed to append to event journal: {e}")
+
+    def query(self, zone_id=None, start=None, end=None, limit=JOURNAL_MAX_QUERY_RESULTS):
+        """Events for one zone (or all zones) with start <= timestamp < end, oldest first."""
+        end = time.time() if end is None else end
+        start = end - JOURNAL_DEFAULT_HISTORY_SECONDS if start is None else start
+        events = []
+        day = datetime.utcfromtimestamp(start).date()
+        while day <= datetime.utcfromtimestamp(end).date() and len(events) < limit:
+            self._query_day(day.strftime("%Y%m%d"), zone_id, start, end, limit, events)
+            day += timedelta(days=1)
+        return events
+
+    def _query_day(self, day, zone_id, start, end, limit, events):
+        data_path = os.path.join(self.directory, day + ".bin")
+        if not os.path.exists(data_path):
+            return
+        first_record = 0
+        try:
+            with open(os.path.join(self.directory, day + ".idx"), "rb") as index_file:
+                index_data = index_file.read()
+            entries = [JOURNAL_INDEX_ENTRY.unpack_from(index_data, offset)
+                       for offset in range(0, len(index_data) - JOURNAL_INDEX_ENTRY.size + 1, JOURNAL_INDEX_ENTRY.size)]
+            position = bisect.bisect_right([minute for minute, _ in entries], int(start // 60)) - 1
+            if position >= 0:
+                first_record = entries[position][1]
+        except OSError:
+            pass  # No index: scan the day from the start
+
+        with open(data_path, "rb") as data_file:
+            data_file.seek(first_record * JOURNAL_RECORD.size)
+            while len(events) < limit:
+                chunk = data_file.read(JOURNAL_READ_CHUNK * JOURNAL_RECORD.size)
+                # Ignore a trailing partial record that is still being written
+                usable = len(chunk) - len(chunk) % JOURNAL_RECORD.size
+                if not usable:
+                    return
+                for timestamp, record_zone, state, mode_code in JOURNAL_RECORD.iter_unpack(chunk[:usable]):
+                    if timestamp >= end:
+                        return
+                    if timestamp < start or (zone_id is not None and record_zone != zone_id):
+                        continue
+                    events.append(self._describe(timestamp, record_zone, state, mode_code))
+                    if len(events) >= limit:
+                        return
+
+    @staticmethod
+    def _describe(timestamp, zone_id, state, mode_code):
+        zone = ZONES_BY_ID.get(zone_id)
+        return {
+            "timestamp": datetime.utcfromtimestamp(timestamp).isoformat() + "Z",
+            "zoneId": None if zone_id == JOURNAL_SYSTEM_ZONE else zone_id,
+            "zone": zone.name if zone else None,
+            "state": JOURNAL_STATES[state] if state < len(JOURNAL_STATES) else state,
+            "mode": JOURNAL_MODES[mode_code] if mode_code < len(JOURNAL_MODES) else None,
+        }
+
+    def _open_day(self, day):
+        if day == self.day:
+            return
+        self.close()
+        data_path = os.path.join(self.directory, day + ".bin")
+        index_path = os.path.join(self.directory, day + ".idx")
+        self.record_count, self.last_indexed_minute = self._repair(data_path, index_path)
+        # Unbuffered so every record reaches the OS as soon as it is appended
+        self.data_file = open(data_path, "ab", buffering=0)
+        self.index_file = open(index_path, "ab", buffering=0)
+        self.day = day
+        self._prune()
+
+    @staticmethod
+    def _repair(data_path, index_path):
+        """
+        Cut a torn trailing record (a crash mid-append) off the day file, and index
+        entries that point past its end, so new records stay aligned. Returns the
+        record count and the last indexed minute.
+        """
+        record_count = 0
+        if os.path.exists(data_path):
+            data_size = os.path.getsize(data_path)
+            record_count = data_size // JOURNAL_RECORD.size
+            if data_size % JOURNAL_RECORD.size:
+                logger.warning(f"Truncating torn record at the end of {data_path}")
+                os.truncate(data_path, record_count * JOURNAL_RECORD.size)
+
+        last_indexed_minute = -1
+        if os.path.exists(index_path):
+            with open(index_path, "rb") as index_file:
+                index_data = index_file.read()
+            valid = 0
+            for minute, first_record in JOURNAL_INDEX_ENTRY.iter_unpack(index_data[:len(index_data) - len(index_data) % JOURNAL_INDEX_ENTRY.size]):
+                if first_record >= record_count:
+                    break
+                last_indexed_minute = minute
+                valid += 1
+            if valid * JOURNAL_INDEX_ENTRY.size != len(index_data):
+                logger.warning(f"Dropping index entries past the end of {data_path}")
+                os.truncate(index_path, valid * JOURNAL_INDEX_ENTRY.size)
+        return record_count, last_indexed_minute
+
+    def _prune(self):
+        cutoff = time.strftime("%Y%m%d", time.gmtime(time.time() - JOURNAL_RETENTION_DAYS * 24 * 60 * 60))
+        for filename in os.listdir(self.directory):
+            if filename[:8] < cutoff and filename.endswith((".bin", ".idx")):
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except OSError as e:
+                    logger.error(f"Failed to prune journal file {filename}: {e}")
+
+    def close(self):
+        for journal_file in (self.data_file, self.index_file):
+            if journal_file:
+                journal_file.close()
+        self.data_file = self.index_file = None
+        self.day = None
+
+
+event_journal = EventJournal(JOURNAL_DIR)
+
+def update_alarm_state_in_db():
+    """Record the current system mode in the state store; the DB write happens in the background."""
+    alarm_state.update(mode=system_mode, connected=system_connected)
+
+def trigger_alarm(edge_time=None):
+    for panel in PANELS:
+        panel.set_siren(True)
+    if latency_probe and edge_time is not None:
+        latency_probe.record("alarm", time.monotonic() - edge_time)
+    event_journal.append(JOURNAL_SYSTEM_ZONE, JOURNAL_STATE_ALARM, system_mode)
+    log_event("ALARM triggered", edge_time)
 
 def stop_alarm():
-    GPIO.output(PIN_SIREN, GPIO.LOW)
+    for panel in PANELS:
+        panel.set_siren(False)
+
+last_event_id = 0
+event_id_lock = threading.Lock()
+latency_probe = None  # Set by the benchmark harness to trace events through the sinks
 
-def log_event(event_description):
-    event_id = str(int(time.time() * 1000))
+def log_event(event_description, edge_time=None):
+    global last_event_id
+    # Event ids are millisecond timestamps; bump on collisions so two events in
+    # the same millisecond don't overwrite each other (or fail a batch write).
+    with event_id_lock:
+        event_id = max(int(time.time() * 1000), last_event_id + 1)
+        last_event_id = event_id
     event_time = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()) + "Z"
     ttl = int(time.time()) + 7 * 24 * 60 * 60  # TTL set to 7 days from now (in seconds)
     event_data = {
-        "id": event_id,
+        "id": str(event_id),
         "event": event_description,
         "timestamp": event_time,
         "ttl": ttl,
         "homeId": HOME_ID  # Add home ID to the event
     }
     logger.info(json.dumps(event_data))
-    logger.debug(f"log_event: ws={ws}, ws.sock={getattr(ws, 'sock', None)}, ws.sock.connected={getattr(getattr(ws, 'sock', None), 'connected', None)}")
-    
-    try:
-        event_logs_table.put_item(Item=event_data)
-    except Exception as e:
-        logger.error(f"Failed to write event to DynamoDB: {e}")
+    if latency_probe and edge_time is not None:
+        latency_probe.mark(event_data["id"], edge_time)
+
+    event_sink.submit(event_data)
 
     # Send the event to WebSocket if it's not a mode change or system event
     if event_description not in ["Arm Stay", "Arm Away", "Disarm"] and "System" not in event_description:
-        ensure_websocket_connection()
-        if ws and ws.sock and ws.sock.connected:
-            try:
-                ws.send(json.dumps(event_data))
-                logger.info("Sent event to WebSocket")
-            except Exception as e:
-                logger.error(f"Failed to send event to WebSocket: {e}")
+        ws_supervisor.send(event_data)
 
 def on_open(wsapp):
     global system_connected
     system_connected = True
-    ws_connected_event.set()
     update_alarm_state_in_db()
 
-def on_message(wsapp, message):
+# Command pipeline: mode commands are acked as soon as they arrive and applied in
+# order on a worker thread, so a burst of commands never waits on the network
+MODE_COMMANDS = ("Arm Stay", "Arm Away", "Disarm")
+COMMAND_QUEUE_SIZE = 100
+COMMAND_ID_CACHE_SIZE = 256  # Recent commandIds remembered to drop retried commands
+COMMAND_STATS_INTERVAL = 300  # Seconds between command latency log lines
+
+class CommandExecutor:
+    """
+    Applies mode commands on a single worker thread under mode_lock. submit()
+    acks immediately; a commandId already seen is re-acked without being
+    applied again. Tracks ack and apply latency per command.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=COMMAND_QUEUE_SIZE)
+        self.lock = threading.Lock()
+        self.recent_acks = OrderedDict()  # commandId -> ack sent for it, oldest first
+        self.metrics = {}
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="CommandExecutor", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def close(self, timeout=5):
+        self.stop_event.set()
+        if self.thread.is_alive():  # Never started in benchmark runs
+            self.thread.join(timeout)
+
+    def submit(self, command, command_id):
+        received = time.monotonic()
+        with self.lock:
+            cached_ack = self.recent_acks.get(command_id)
+            if cached_ack:
+                self.recent_acks.move_to_end(command_id)
+                self._count(command, "duplicates")
+            else:
+                # Enqueue before acking so success is only reported for commands that will be applied
+                try:
+                    self.queue.put_nowait((command, command_id, received))
+                    accepted = True
+                except queue.Full:
+                    accepted = False
+                    self._count(command, "dropped")
+                ack = {
+                    "id": str(int(time.time() * 1000)),
+                    "type": "command_ack",
+                    "commandId": command_id,
+                    "success": accepted,
+                    "homeId": HOME_ID,
+                    "state": command,
+                    "timestamp": datetime.utcnow().isoformat()
+                }
+                if not accepted:
+                    ack["error"] = "Command queue full"
+                elif command_id != "unknown":
+                    # Only successful acks are cached, so a retry of a dropped command is tried again
+                    self.recent_acks[command_id] = ack
+                    if len(self.recent_acks) > COMMAND_ID_CACHE_SIZE:
+                        self.recent_acks.popitem(last=False)
+
+        if cached_ack:
+            logger.info(f"Duplicate command {command} with ID: {command_id}, re-sending ack")
+            ws_supervisor.send(cached_ack)
+            return
+
+        if not ack["success"]:
+            logger.error(f"Command queue full, rejecting {command} with ID: {command_id}")
+        ws_supervisor.send(ack)
+        self._record(command, "ackMs", time.monotonic() - received)
+
+    def stats(self):
+        with self.lock:
+            return {command: dict(metrics) for command, metrics in self.metrics.items()}
+
+    def _count(self, command, key):
+        metrics = self.metrics.setdefault(command, {})
+        metrics[key] = metrics.get(key, 0) + 1
+
+    def _record(self, command, key, latency):
+        latency_ms = latency * 1000
+        with self.lock:
+            metrics = self.metrics.setdefault(command, {})
+            metrics[key + "Count"] = metrics.get(key + "Count", 0) + 1
+            metrics[key + "Total"] = metrics.get(key + "Total", 0) + latency_ms
+            metrics[key + "Max"] = max(metrics.get(key + "Max", 0), latency_ms)
+
+    def _run(self):
+        last_stats = time.monotonic()
+        while not self.stop_event.is_set():
+            try:
+                command, command_id, received = self.queue.get(timeout=1)
+            except queue.Empty:
+                command = None
+            if command:
+                try:
+                    apply_mode_command(command)
+                    self._record(command, "applyMs", time.monotonic() - received)
+                except Exception as e:
+                    logger.error(f"Error applying command {command} with ID {command_id}: {e}")
+                    with self.lock:
+                        self._count(command, "errors")
+            if time.monotonic() - last_stats >= COMMAND_STATS_INTERVAL:
+                last_stats = time.monotonic()
+                logger.info(f"Command stats: {json.dumps(self.stats())}")
+
+
+def apply_mode_command(command):
     global system_mode, manual_override, manual_override_until, last_arm_was_auto
+    with mode_lock:
+        system_mode = command
+        event_journal.append(JOURNAL_SYSTEM_ZONE, JOURNAL_STATE_MODE, system_mode)
+        if system_mode == "Disarm":
+            stop_alarm()
+
+        # Handle overrides logic
+        if system_mode in ["Arm Stay", "Arm Away"]:
+            manual_override = False
+            manual_override_until = None
+            last_arm_was_auto = False
+        elif system_mode == "Disarm":
+            if last_arm_was_auto:
+                manual_override = True
+                manual_override_until = int(time.time()) + MANUAL_OVERRIDE_TTL_MINUTES * 60
+                logger.info(f"Manual override set until {datetime.utcfromtimestamp(manual_override_until).isoformat()}")
+                last_arm_was_auto = False
+            else:
+                manual_override = False
+                manual_override_until = None
+
+        # Let the schedule re-evaluate against the new mode and override
+        auto_arm_schedule.next_check = 0
+
+        log_event(f"System mode changed to {system_mode}")
+        update_alarm_state_in_db()
+
+
+command_executor = CommandExecutor()
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def parse_history_request(message_data):
+    """Validates GetEventHistory arguments. Returns (query kwargs, None) or (None, error message)."""
+    zone_id = message_data.get("zone")
+    if isinstance(zone_id, str):
+        zone_id = next((zone.id for zone in ZONES if zone.name == zone_id), -1)
+    elif zone_id is not None and not (isinstance(zone_id, int) and not isinstance(zone_id, bool)):
+        return None, "zone must be a zone name or id"
+
+    now = time.time()
+    start = message_data.get("start")
+    end = message_data.get("end")
+    for name, value in (("start", start), ("end", end)):
+        if value is not None and not (is_number(value) and 0 <= value <= now + JOURNAL_MAX_FUTURE_SECONDS):
+            return None, f"{name} must be epoch seconds"
+    end = now if end is None else end
+    start = end - JOURNAL_DEFAULT_HISTORY_SECONDS if start is None else start
+    if start >= end:
+        return None, "start must be before end"
+    # Nothing older than the retention window is on disk, so don't walk those days
+    start = max(start, now - JOURNAL_RETENTION_DAYS * 24 * 60 * 60)
+
+    limit = message_data.get("limit", JOURNAL_MAX_QUERY_RESULTS)
+    if not (isinstance(limit, int) and not isinstance(limit, bool)) or limit < 1:
+        return None, "limit must be a positive integer"
+    return {"zone_id": zone_id, "start": start, "end": end, "limit": min(limit, JOURNAL_MAX_QUERY_RESULTS)}, None
+
+def on_message(wsapp, message):
     logger.info(f"Message from server: {message}")
     try:
         message_data = json.loads(message)
@@ -144,11 +1214,11 @@ def on_message(wsapp, message):
                 "event": "pong",
                 "homeId": HOME_ID,
                 "instanceId": INSTANCE_ID,
-                "systemState": system_mode,
+                "systemState": alarm_state.snapshot()["mode"],
                 "timestamp": datetime.utcnow().isoformat()
             }
-            wsapp.send(json.dumps(pong_response))
-            logger.info("Sent pong response to WebSocket")
+            ws_supervisor.send(pong_response)
+            logger.info("Queued pong response to WebSocket")
             return
             
         # Handle command messages
@@ -158,60 +1228,57 @@ def on_message(wsapp, message):
             
             logger.info(f"Received command: {command} with ID: {command_id}")
             
-            if command in ["Arm Stay", "Arm Away", "Disarm"]:
-                previous_mode = system_mode
-                system_mode = command
-                
-                # Send command acknowledgment
-                ack_response = {
+            if command in MODE_COMMANDS:
+                # Acked here, applied on the command worker
+                command_executor.submit(command, command_id)
+            
+            # Add support for GetSystemState command
+            elif command == "GetSystemState":
+                # Answered from the local state store; never touches the network
+                state = alarm_state.snapshot()
+                state_response = {
                     "id": str(int(time.time() * 1000)),
                     "type": "command_ack",
                     "commandId": command_id,
                     "success": True,
                     "homeId": HOME_ID,
-                    "state": system_mode,
+                    "state": state["mode"],
+                    "version": state["version"],
                     "timestamp": datetime.utcnow().isoformat()
                 }
-                wsapp.send(json.dumps(ack_response))
-                
-                # Continue with the rest of the operations
-                log_event(f"System mode changed to {system_mode}")
-                
-                # Handle overrides logic
-                if system_mode in ["Arm Stay", "Arm Away"]:
-                    manual_override = False
-                    manual_override_until = None
-                    last_arm_was_auto = False
-                elif system_mode == "Disarm":
-                    if last_arm_was_auto:
-                        manual_override = True
-                        manual_override_until = datetime.utcnow() + timedelta(minutes=MANUAL_OVERRIDE_TTL_MINUTES)
-                        logger.info(f"Manual override set until {manual_override_until.isoformat()}")
-                        last_arm_was_auto = False
-                    else:
-                        manual_override = False
-                        manual_override_until = None
-
-                if system_mode == "Disarm":
-                    stop_alarm()
-                
-                # Update AlarmState in DB
-                update_alarm_state_in_db()
-            
-            # Add support for GetSystemState command
-            elif command == "GetSystemState":
-                # Send current system state back to requestor
-                state_response = {
+                ws_supervisor.send(state_response)
+                logger.info(f"Responded to GetSystemState request with state: {state['mode']}")
+
+            elif command == "GetEventHistory":
+                # Served from the local journal: optional zone (name or id), start/end
+                # (epoch seconds, default last 24 hours) and limit
+                query, error = parse_history_request(message_data)
+                if error:
+                    ws_supervisor.send({
+                        "id": str(int(time.time() * 1000)),
+                        "type": "command_ack",
+                        "command": "GetEventHistory",
+                        "commandId": command_id,
+                        "success": False,
+                        "error": error,
+                        "homeId": HOME_ID,
+                        "timestamp": datetime.utcnow().isoformat()
+                    })
+                    logger.warning(f"Rejected GetEventHistory request: {error}")
+                    return
+                events = event_journal.query(**query)
+                history_response = {
                     "id": str(int(time.time() * 1000)),
                     "type": "command_ack",
+                    "command": "GetEventHistory",
                     "commandId": command_id,
                     "success": True,
                     "homeId": HOME_ID,
-                    "state": system_mode,
+                    "events": events,
                     "timestamp": datetime.utcnow().isoformat()
                 }
-                wsapp.send(json.dumps(state_response))
-                logger.info(f"Responded to GetSystemState request with state: {system_mode}")
+                ws_supervisor.send(history_response)
+                logger.info(f"Responded to GetEventHistory request with {len(events)} events")
     except Exception as e:
         logger.error(f"Error parsing message data: {e}")
 
@@ -228,128 +1295,419 @@ def on_error(wsapp, error):
         logger.error(f"Error during error debugging: {debug_e}")
 
 def on_close(wsapp, close_status_code, close_msg):
-    global ws, system_connected
-    ws = None
+    global system_connected
     system_connected = False
     logger.info(f"WebSocket closed with code: {close_status_code}, reason: {close_msg}")
     logger.debug(f"on_close wsapp: {wsapp}")
     logger.debug(f"on_close wsapp.sock: {getattr(wsapp, 'sock', None)}")
     logger.debug(f"on_close wsapp.sock.connected: {getattr(getattr(wsapp, 'sock', None), 'connected', None)}")
-    ws_connected_event.clear()
     update_alarm_state_in_db()
 
-def ensure_websocket_connection():
-    global ws
-    reconnect_attempts = 0
-    while not ws_connected_event.is_set() and reconnect_attempts < MAX_RECONNECT_ATTEMPTS:
-        if ws is None or not ws.sock or not ws.sock.connected:
+class WebSocketSupervisor:
+    """
+    Owns the one WebSocketApp for this process. A supervisor thread keeps it
+    connected, reconnecting with jittered exponential backoff, and a sender
+    thread drains the outbound queue whenever the link is up. send() never
+    blocks, so zone scanning and alarm handling don't wait on the network.
+    """
+
+    def __init__(self, url, app_factory=None):
+        self.url = url
+        app_factory = app_factory or websocket.WebSocketApp
+        self.app = app_factory(url,
+                               on_open=self._on_open,
+                               on_message=on_message,
+                               on_error=on_error,
+                               on_close=self._on_close)
+        self.connected = threading.Event()
+        self.stop_event = threading.Event()
+        self.outbound = queue.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+        self.dropped = 0
+        self.threads = [
+            threading.Thread(target=self._supervise, name="WebSocketSupervisor", daemon=True),
+            threading.Thread(target=self._send_loop, name="WebSocketSender", daemon=True),
+        ]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def close(self):
+        self.stop_event.set()
+        self.app.close()
+
+    def send(self, message):
+        """Queue a message for delivery. When the queue is full the oldest message is discarded."""
+        payload = json.dumps(message)
+        while True:
             try:
-                logger.info(f"Attempting to connect to WebSocket... [Attempt {reconnect_attempts+1}/{MAX_RECONNECT_ATTEMPTS}]")
-                logger.info(f"WebSocket URL: {ws_url}")
-                ws = websocket.WebSocketApp(ws_url,
-                                            on_open=on_open,
-                                            on_message=on_message,
-                                            on_error=on_error,
-                                            on_close=on_close)
-                thread = threading.Thread(target=ws.run_forever)
-                thread.daemon = True
-                thread.start()
-                ws_connected_event.wait(10)  # Wait for connection to establish
-                if ws_connected_event.is_set():
-                    logger.info("WebSocket connection established.")
-                    break
-                else:
-                    logger.warning("WebSocket connection not established after wait.")
+                self.outbound.put_nowait(payload)
+                return
+            except queue.Full:
+                try:
+                    self.outbound.get_nowait()
+                    self.dropped += 1
+                    logger.warning(f"WebSocket send queue full, dropped oldest message ({self.dropped} dropped so far)")
+                except queue.Empty:
+                    pass
+
+    def _on_open(self, wsapp):
+        logger.info("WebSocket connection established.")
+        self.connected.set()
+        on_open(wsapp)
+
+    def _on_close(self, wsapp, close_status_code, close_msg):
+        self.connected.clear()
+        on_close(wsapp, close_status_code, close_msg)
+
+    def _supervise(self):
+        attempt = 0
+        while not self.stop_event.is_set():
+            logger.info(f"Connecting to WebSocket {self.url} [attempt {attempt + 1}]")
+            started = time.monotonic()
+            try:
+                self.app.run_forever(ping_interval=WS_PING_INTERVAL, ping_timeout=WS_PING_TIMEOUT)
             except Exception as e:
-                logger.error(f"Failed to connect to WebSocket: {e}")
-            finally:
-                # Print out the current thread list for debugging
-                import threading as th
-                logger.debug(f"Active threads: {[t.name for t in th.enumerate()]}")
+                logger.error(f"WebSocket run_forever raised: {e}")
+            self.connected.clear()
+            if self.stop_event.is_set():
+                break
 
-        else:
-            logger.debug("WebSocket object exists and appears connected.")
+            # A connection that stayed up for a while resets the backoff
+            if time.monotonic() - started > RECONNECT_MAX_WAIT:
+                attempt = 0
+            window = min(RECONNECT_MAX_WAIT, RECONNECT_MIN_WAIT * (2 ** attempt))
+            wait_time = random.uniform(RECONNECT_MIN_WAIT, max(RECONNECT_MIN_WAIT, window))
+            logger.info(f"WebSocket disconnected, reconnecting in {wait_time:.1f} seconds.")
+            self.stop_event.wait(wait_time)
+            attempt += 1
+
+    def _send_loop(self):
+        payload = None
+        while not self.stop_event.is_set():
+            if payload is None:
+                try:
+                    payload = self.outbound.get(timeout=1)
+                except queue.Empty:
+                    continue
+            if not self.connected.wait(1):
+                continue
+            try:
+                self.app.send(payload)
+                payload = None
+            except Exception as e:
+                # Keep the message and retry; a dead link is torn down by the ping timeout
+                logger.error(f"Failed to send to WebSocket: {e}")
+                self.stop_event.wait(1)
 
-        wait_time = RECONNECT_MIN_WAIT * (RECONNECT_EXPONENTIAL_BACKOFF ** reconnect_attempts)
-        logger.info(f"Waiting {wait_time} seconds before next reconnect attempt.")
-        time.sleep(wait_time)
-        reconnect_attempts += 1
 
-    if reconnect_attempts >= MAX_RECONNECT_ATTEMPTS:
-        logger.error("Maximum WebSocket reconnection attempts reached.")
-    # Log final state of ws object
-    logger.debug(f"Final ws object: {ws}")
-    if ws and hasattr(ws, 'sock'):
-        logger.debug(f"ws.sock: {ws.sock}, ws.sock.connected: {getattr(ws.sock, 'connected', None)}")
+ws_supervisor = WebSocketSupervisor(ws_url)
 
 def auto_arm_disarm():
     global system_mode, last_arm_was_auto, manual_override, manual_override_until
 
-    # Check if manual override expired
-    if manual_override and manual_override_until:
-        if datetime.utcnow() > manual_override_until:
-            # Override expired
+    now = int(time.time())
+    if now < auto_arm_schedule.next_check:
+        return
+
+    with mode_lock:
+        # Check if manual override expired
+        if manual_override and manual_override_until and now >= manual_override_until:
             manual_override = False
             manual_override_until = None
             logger.info("Manual override expired, auto-arm allowed again.")
 
-    # If override is active, skip auto-arm actions
-    if manual_override:
-        return
-
-    utc_now = datetime.utcnow()
-    est = pytz.timezone('US/Eastern')
-    est_now = utc_now.astimezone(est)
+        auto_arm_schedule.refresh(now)
+        next_check = auto_arm_schedule.next_transition(now)
+        if manual_override:
+            # If override is active, skip auto-arm actions until it expires
+            auto_arm_schedule.next_check = min(next_check, manual_override_until)
+            return
+        auto_arm_schedule.next_check = next_check
 
-    # Auto-arm if between 2:30AM and 5:00AM and currently disarmed
-    if (est_now.hour > 2 or (est_now.hour == 2 and est_now.minute >= 30)) and (est_now.hour < 5 or (est_now.hour == 5 and est_now.minute < 30)):
-        if system_mode == "Disarm":
-            system_mode = "Arm Stay"
-            log_event("System mode changed to Arm Stay (auto)")
-            last_arm_was_auto = True
-    # Auto-disarm at or after 5:30AM if currently arm stay and previously auto
-    elif est_now.hour == 5 and est_now.minute >= 30:
-        if system_mode == "Arm Stay":
+        # Auto-arm while inside an arm window and currently disarmed
+        armed_mode = auto_arm_schedule.armed_window(now)
+        if armed_mode:
+            if system_mode == "Disarm":
+                system_mode = armed_mode
+                event_journal.append(JOURNAL_SYSTEM_ZONE, JOURNAL_STATE_MODE, system_mode)
+                log_event(f"System mode changed to {armed_mode} (auto)")
+                last_arm_was_auto = True
+                update_alarm_state_in_db()
+        # Auto-disarm during the grace period after a window if still in the window's mode
+        elif auto_arm_schedule.disarm_window(now) == system_mode:
             system_mode = "Disarm"
+            event_journal.append(JOURNAL_SYSTEM_ZONE, JOURNAL_STATE_MODE, system_mode)
             log_event("System mode changed to Disarm (auto)")
             last_arm_was_auto = True
+            update_alarm_state_in_db()
 
-try:
-    logger.info("Starting sensor monitoring...")
-    time.sleep(5)  # Short delay before connecting
-    ensure_websocket_connection()
-    log_event(f"Connected from {HOME_ID}")
+def handle_zone_change(zone, current_state, edge_time):
+    event_journal.append(zone.id, JOURNAL_STATE_OPENED if current_state else JOURNAL_STATE_CLOSED, system_mode)
+    if zone.sensor_type != "motion":
+        log_event(f"{zone.name} {'opened' if current_state else 'closed'}", edge_time)
 
-    # Initial state setup for zones
-    pins = [PIN_DOOR, PIN_MOTION, PIN_ZONE_3, PIN_ZONE_4, PIN_ZONE_5, PIN_ZONE_6, PIN_ZONE_7, PIN_ZONE_8]
-    zone_names = ["Front Door", "MOTION", "ZONE 3",
-                  "Basement Window", "Office Window", "ZONE 6", "Rear Lower Windows", "Attic Door"]
-    prev_states = [GPIO.input(pin) for pin in pins]
+    # Each zone sounds the siren only in the modes its arming rule lists
+    if current_state and system_mode in zone.arm_modes:
+        trigger_alarm(edge_time)
 
-    while True:
-        ensure_websocket_connection()
+def check_zone(zone, now):
+    """Read a zone and apply its debounce window, dispatching accepted changes."""
+    current_state = zone.panel.read(zone)
+    if current_state == zone.state:
+        zone.recheck_at = None
+        return
+
+    # A change inside the debounce window is treated as chatter; look again once
+    # the window closes so a real transition that settled during it is not lost.
+    if now - zone.last_change < zone.debounce:
+        zone.recheck_at = zone.last_change + zone.debounce
+        return
+
+    zone.state = current_state
+    zone.last_change = now
+    zone.recheck_at = None
+    handle_zone_change(zone, current_state, now)
+
+def start_zone_monitoring():
+    for panel in PANELS:
+        panel.setup()
+        panel.start()
+        logger.info(f"Monitoring panel {panel.id}: {len(panel.zones)} zones")
+
+def dispatch_zone_events(timeout):
+    """Block for up to `timeout` seconds waiting for edges, then process them."""
+    pending = [zone.recheck_at for zone in ZONES if zone.recheck_at is not None]
+    if pending:
+        timeout = max(0, min(timeout, min(pending) - time.monotonic()))
+
+    try:
+        zone, edge_time = zone_events.get(timeout=timeout)
+        check_zone(zone, edge_time)
+        # Drain anything that queued up behind the first edge
+        while True:
+            zone, edge_time = zone_events.get_nowait()
+            check_zone(zone, edge_time)
+    except queue.Empty:
+        pass
+
+    now = time.monotonic()
+    for zone in ZONES:
+        if zone.recheck_at is not None and now >= zone.recheck_at:
+            check_zone(zone, now)
+
+def resync_zones():
+    """Re-read every zone so an edge the kernel dropped cannot leave a stale state."""
+    now = time.monotonic()
+    for zone in ZONES:
+        check_zone(zone, now)
+
+def run_dispatcher(stop_event):
+    """Main loop: auto-arm checks, edge dispatch and periodic zone resync until stop_event is set."""
+    start_zone_monitoring()
+    last_resync = time.monotonic()
+
+    while not stop_event.is_set():
         auto_arm_disarm()
-        for index, pin in enumerate(pins):
-            current_state = GPIO.input(pin)
-            if current_state != prev_states[index]:
-                zone_name = zone_names[index]
-                if zone_name != "MOTION":
-                    log_event(f"{zone_name} {'opened' if current_state else 'closed'}")
-
-                # Handle system modes for specific sensors
-                if system_mode == "Arm Away" and current_state:
-                    trigger_alarm()
-                elif system_mode == "Arm Stay":
-                    if current_state and zone_name != "MOTION":
-                        trigger_alarm()
-
-                prev_states[index] = current_state
-
-        time.sleep(1)
-
-except KeyboardInterrupt:
-    logger.info("Script terminated by user")
-finally:
-    GPIO.cleanup()
-    if ws:
-        ws.close()
+        # Sleep until the next edge, zone resync or schedule transition
+        timeout = min(last_resync + ZONE_RESYNC_INTERVAL - time.monotonic(),
+                      auto_arm_schedule.next_check - time.time())
+        dispatch_zone_events(max(0, timeout))
+
+        if time.monotonic() - last_resync >= ZONE_RESYNC_INTERVAL:
+            resync_zones()
+            last_resync = time.monotonic()
+
+def shutdown():
+    command_executor.close()
+    event_sink.close()
+    ws_supervisor.close()
+    alarm_state.close()
+    event_journal.close()
+    for backend in gpio_backends.values():
+        backend.cleanup()
+
+
+# --- Benchmark harness ---
+# Runs the real dispatcher, event pipeline and WebSocket supervisor against a
+# simulated board and in-process sinks, and reports edge-to-siren and
+# edge-to-sink latency. Nothing leaves the machine.
+
+class LatencyProbe:
+    """Collects edge-to-X latencies (seconds) keyed by sink name."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.edge_times = {}  # event id -> edge time
+        self.samples = {"alarm": [], "dynamodb": [], "websocket": []}
+
+    def mark(self, event_id, edge_time):
+        with self.lock:
+            self.edge_times[event_id] = edge_time
+
+    def record(self, sink, latency):
+        with self.lock:
+            self.samples[sink].append(latency)
+
+    def record_event(self, sink, event_id):
+        now = time.monotonic()
+        with self.lock:
+            edge_time = self.edge_times.get(event_id)
+            if edge_time is not None:
+                self.samples[sink].append(now - edge_time)
+
+    def report(self):
+        lines = []
+        with self.lock:
+            for sink, samples in self.samples.items():
+                if not samples:
+                    lines.append(f"  {sink:<10} no samples")
+                    continue
+                ordered = sorted(samples)
+                pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+                lines.append(f"  {sink:<10} n={len(ordered):<7} p50={pick(0.5):8.2f}ms p95={pick(0.95):8.2f}ms "
+                             f"p99={pick(0.99):8.2f}ms max={ordered[-1] * 1000:8.2f}ms")
+        return "\n".join(lines)
+
+
+class SimulatedDynamoDB:
+    """Stands in for the DynamoDB resource: every call takes `latency` seconds and succeeds."""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def Table(self, name):
+        return self
+
+    def put_item(self, **kwargs):
+        time.sleep(self.latency)
+
+    def batch_write_item(self, RequestItems):
+        time.sleep(self.latency)
+        for requests in RequestItems.values():
+            for request in requests:
+                latency_probe.record_event("dynamodb", request["PutRequest"]["Item"]["id"])
+        return {}
+
+
+class SimulatedWebSocketApp:
+    """Stands in for websocket.WebSocketApp: connects immediately and records what is sent."""
+
+    def __init__(self, url, on_open=None, on_message=None, on_error=None, on_close=None):
+        self.on_open = on_open
+        self.on_close = on_close
+        self.closed = threading.Event()
+
+    def run_forever(self, **kwargs):
+        self.on_open(self)
+        self.closed.wait()
+        self.on_close(self, 1000, "closed")
+
+    def send(self, payload):
+        latency_probe.record_event("websocket", json.loads(payload).get("id"))
+
+    def close(self):
+        self.closed.set()
+
+
+def generate_load(board, pins, rate, count, replay_path=None):
+    """
+    Drive the simulated board. With replay_path, replays JSON lines of
+    {"offset": seconds, "pin": n, "level": 0|1}; otherwise toggles `pins`
+    round-robin `count` times at `rate` transitions per second.
+    """
+    if replay_path:
+        with open(replay_path) as replay_file:
+            transitions = [json.loads(line) for line in replay_file if line.strip()]
+        schedule = [(t["offset"], t["pin"], t["level"]) for t in transitions]
+    else:
+        schedule = [(i / rate, pins[i % len(pins)], (i // len(pins) + 1) % 2) for i in range(count)]
+
+    start = time.monotonic()
+    for offset, pin, level in schedule:
+        delay = start + offset - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        board.set_input(pin, level)
+    return len(schedule), time.monotonic() - start
+
+def run_benchmark(args):
+    global dynamodb, ws_supervisor, event_sink, event_journal, latency_probe, system_mode
+
+    work_dir = tempfile.mkdtemp(prefix="casa-bench-")
+    latency_probe = LatencyProbe()
+    dynamodb = SimulatedDynamoDB(args.sink_latency_ms / 1000.0)
+    table_cache.clear()
+    ws_supervisor = WebSocketSupervisor(ws_url, app_factory=SimulatedWebSocketApp)
+    event_sink = EventSink(EVENT_LOGS_TABLE, os.path.join(work_dir, "event-spool.jsonl"))
+    event_journal = EventJournal(os.path.join(work_dir, "event-journal"))
+
+    bench_config = {"panels": [{
+        "id": "bench",
+        "sirenPin": 0,
+        "zones": [{"name": f"Bench Zone {n}", "pin": n + 1, "debounceMs": args.debounce_ms} for n in range(args.zones)],
+    }]}
+    setup_panels(bench_config, backend_override="sim")
+    system_mode = "Arm Away"  # Every open sounds the siren
+
+    event_sink.start()
+    alarm_state.start()
+    ws_supervisor.start()
+    stop_event = threading.Event()
+    dispatcher = threading.Thread(target=run_dispatcher, args=(stop_event,), name="Dispatcher", daemon=True)
+    dispatcher.start()
+    time.sleep(0.5)  # Let the dispatcher register edge callbacks
+
+    print(f"Benchmark: {args.zones} zones, target {args.rate}/s, sink latency {args.sink_latency_ms}ms")
+    sent, elapsed = generate_load(get_gpio_backend("sim"), [zone.pin for zone in ZONES],
+                                  args.rate, args.events, args.replay)
+    print(f"Generated {sent} transitions in {elapsed:.2f}s ({sent / elapsed:.0f}/s)")
+
+    # Wait for the pipeline to drain before reporting
+    deadline = time.monotonic() + args.drain_timeout
+    while time.monotonic() < deadline and (not zone_events.empty() or event_sink.queue.qsize()
+                                           or not ws_supervisor.outbound.empty()):
+        time.sleep(0.1)
+    time.sleep(EVENT_BATCH_WAIT * 2)
+    stop_event.set()
+
+    print("Latency from edge:")
+    print(latency_probe.report())
+    print(f"Event sink: {json.dumps(event_sink.stats())}")
+    print(f"WebSocket sends dropped: {ws_supervisor.dropped}")
+    shutdown()
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Casa alarm panel: zone monitoring, alarm control and event reporting.")
+    parser.add_argument('--benchmark', action='store_true', help='Run the latency benchmark on a simulated board instead of monitoring')
+    parser.add_argument('--zones', type=int, default=8, help='Benchmark: number of simulated zones (default: 8)')
+    parser.add_argument('--events', type=int, default=10000, help='Benchmark: number of synthetic transitions (default: 10000)')
+    parser.add_argument('--rate', type=float, default=2000, help='Benchmark: transitions per second (default: 2000)')
+    parser.add_argument('--debounce-ms', type=int, default=0, help='Benchmark: zone debounce window (default: 0)')
+    parser.add_argument('--sink-latency-ms', type=float, default=20, help='Benchmark: simulated DynamoDB call latency (default: 20)')
+    parser.add_argument('--replay', help='Benchmark: JSON lines file of {"offset", "pin", "level"} transitions to replay')
+    parser.add_argument('--drain-timeout', type=float, default=30, help='Benchmark: seconds to wait for sinks to drain (default: 30)')
+    return parser.parse_args()
+
+def main():
+    try:
+        logger.info("Starting sensor monitoring...")
+        setup_panels(SITE_CONFIG)
+        event_sink.start()
+        alarm_state.start()
+        command_executor.start()
+        time.sleep(5)  # Short delay before connecting
+        ws_supervisor.start()
+        log_event(f"Connected from {HOME_ID}")
+        run_dispatcher(threading.Event())
+    except KeyboardInterrupt:
+        logger.info("Script terminated by user")
+    finally:
+        shutdown()
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    if args.benchmark:
+        run_benchmark(args)
+    else:
+        main()
@@ -0,0 +1,179 @@
+# Deployment Commands:
+# This module is imported by casa-cameras-local-writer.py, hls.py and cameras-main.py.
+# Copy it next to whichever of those a box runs, e.g.
+# scp programs/cloudwatch_metrics.py programs/hls.py drabindr@casa5:/home/drabindr/
+
+"""
+Buffered CloudWatch metrics for the camera programs.
+
+Calls to increment/observe/gauge only update an in-memory aggregate, so they are
+safe on hot paths (per segment, per upload). A background thread turns the
+aggregates into datums every flush interval and sends them with as few
+put_metric_data calls as possible. If CloudWatch can't be reached (or throttles)
+the datums are kept, up to max_buffered, and sent with their original timestamps
+once it can. A batch CloudWatch rejects as invalid is logged and dropped.
+"""
+
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError, ParamValidationError
+
+# --- Constants ---
+MAX_DATUMS_PER_CALL = 1000 # put_metric_data accepts at most 1000 datums per request
+DEFAULT_FLUSH_INTERVAL_SECONDS = 60 # Matches CloudWatch's standard one-minute resolution
+DEFAULT_MAX_BUFFERED_DATUMS = 20000 # Datums held while CloudWatch is unreachable; the oldest go first
+RETRYABLE_ERROR_CODES = {"Throttling", "ThrottlingException", "RequestLimitExceeded", "ServiceUnavailable",
+                         "InternalFailure", "InternalServiceError", "RequestTimeout"}
+
+
+def is_retryable(error):
+    """Throttling, 5xx and network errors are worth retrying; a request CloudWatch rejects never succeeds."""
+    if isinstance(error, ClientError):
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+        return error.response.get('Error', {}).get('Code') in RETRYABLE_ERROR_CODES or status >= 500
+    # botocore refused to build the request (bad parameter types); anything else is connection-level
+    return not isinstance(error, (ParamValidationError, TypeError, ValueError))
+
+
+class MetricsBuffer:
+    """
+    Aggregates metrics per (name, unit, dimensions) and flushes them in batches.
+
+      - increment(): counter, sent as a statistic set so Sum and SampleCount match
+        what one datum per event used to give.
+      - observe(): any sampled value (durations, sizes, percentages), sent as a
+        statistic set (SampleCount, Sum, Minimum, Maximum).
+      - gauge(): only the latest value per interval is sent.
+
+    client can be assigned (or replaced) after construction; while it is None,
+    nothing is recorded, like the emit_metric helpers this replaces.
+    """
+
+    def __init__(self, namespace, client=None, flush_interval=DEFAULT_FLUSH_INTERVAL_SECONDS,
+                 max_buffered=DEFAULT_MAX_BUFFERED_DATUMS, logger=None):
+        self.namespace = namespace
+        self.client = client
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self.logger = logger or logging.getLogger()
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock() # One flush at a time, so re-queued datums keep their order
+        self.stats = {} # key -> [timestamp, count, sum, min, max]
+        self.gauges = {} # key -> [timestamp, value]
+        self.pending = deque() # Built datums waiting to be sent
+        self.dropped = 0 # Datums discarded because the buffer was full
+        self.rejected = 0 # Datums discarded because CloudWatch refused their batch
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    @staticmethod
+    def key(name, unit, dimensions):
+        return name, unit, tuple((d['Name'], d['Value']) for d in dimensions or ())
+
+    def observe(self, name, value, unit="Count", dimensions=None):
+        if self.client is None:
+            return
+        key = self.key(name, unit, dimensions)
+        with self.lock:
+            stat = self.stats.get(key)
+            if stat is None:
+                self.stats[key] = [datetime.now(timezone.utc), 1, value, value, value]
+            else:
+                stat[1] += 1
+                stat[2] += value
+                stat[3] = min(stat[3], value)
+                stat[4] = max(stat[4], value)
+
+    def increment(self, name, value=1, unit="Count", dimensions=None):
+        self.observe(name, value, unit, dimensions)
+
+    def gauge(self, name, value, unit="None", dimensions=None):
+        if self.client is None:
+            return
+        with self.lock:
+            self.gauges[self.key(name, unit, dimensions)] = [datetime.now(timezone.utc), value]
+
+    def collect(self):
+        """Moves the current aggregates into the pending buffer as datums."""
+        with self.lock:
+            stats, self.stats = self.stats, {}
+            gauges, self.gauges = self.gauges, {}
+            for (name, unit, dims), (timestamp, count, total, low, high) in stats.items():
+                datum = {
+                    'MetricName': name,
+                    'Timestamp': timestamp,
+                    'StatisticValues': {'SampleCount': count, 'Sum': total, 'Minimum': low, 'Maximum': high},
+                    'Unit': unit,
+                }
+                if dims:
+                    datum['Dimensions'] = [{'Name': n, 'Value': v} for n, v in dims]
+                self.pending.append(datum)
+            for (name, unit, dims), (timestamp, value) in gauges.items():
+                datum = {'MetricName': name, 'Timestamp': timestamp, 'Value': value, 'Unit': unit}
+                if dims:
+                    datum['Dimensions'] = [{'Name': n, 'Value': v} for n, v in dims]
+                self.pending.append(datum)
+            self.trim()
+
+    def trim(self):
+        overflow = len(self.pending) - self.max_buffered
+        if overflow > 0:
+            for _ in range(overflow):
+                self.pending.popleft()
+            self.dropped += overflow
+            self.logger.warning(f"Metrics buffer full, dropped {overflow} oldest datums ({self.dropped} in total).")
+
+    def flush(self):
+        """Sends everything buffered; returns the number of datums sent. Stops at the first call that can be retried."""
+        self.collect()
+        sent = 0
+        with self.send_lock:
+            while self.client is not None:
+                with self.lock:
+                    batch = [self.pending.popleft() for _ in range(min(MAX_DATUMS_PER_CALL, len(self.pending)))]
+                if not batch:
+                    break
+                try:
+                    self.client.put_metric_data(Namespace=self.namespace, MetricData=batch)
+                    sent += len(batch)
+                except Exception as e:
+                    if not is_retryable(e):
+                        self.rejected += len(batch)
+                        self.logger.error(f"CloudWatch rejected {len(batch)} datums, dropping them ({self.rejected} in total): {e}")
+                        continue
+                    # Put the batch back in front of anything collected meanwhile and retry next interval
+                    with self.lock:
+                        self.pending.extendleft(reversed(batch))
+                        self.trim()
+                    self.logger.error(f"Failed to send {len(batch)} CloudWatch datums ({len(self.pending)} buffered): {e}")
+                    break
+        if sent:
+            self.logger.debug(f"Sent {sent} CloudWatch datums to {self.namespace}.")
+        return sent
+
+    def run(self):
+        while not self.stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                self.logger.error(f"Unexpected error flushing CloudWatch metrics: {e}")
+
+    def start(self):
+        """Starts the background flush thread (idempotent)."""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="MetricsFlusher", daemon=True)
+            self.thread.start()
+        return self
+
+    def close(self, timeout=10):
+        """Stops the flush thread and makes a last attempt to send what is buffered."""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=timeout)
+        try:
+            self.flush()
+        except Exception as e:
+            self.logger.error(f"Final CloudWatch metrics flush failed: {e}")
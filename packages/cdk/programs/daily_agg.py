@@ -3,9 +3,21 @@ import os
 import ffmpeg
 import re
 import concurrent.futures
+import collections
+import shutil
+import fcntl
+import contextlib
+import math
+import threading
+import time
 import argparse
-from datetime import datetime, timedelta
+import json
+import tempfile
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
 from PIL import Image
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
 
 # AWS Credentials and Setup
 aws_access_key_id = os.environ.get('AWS_ACCESS_KEY_ID')
@@ -32,183 +44,691 @@ def clean_directory(directory):
         os.makedirs(directory)
         print(f"Created directory: {directory}")
 
-# Function to get all video files for a given day (in EST) from S3 (stored in UTC)
-def get_video_files(bucket, address, camera, date_est, limit=None):
-    date_est_start = datetime.strptime(date_est, '%Y-%m-%d')
-    date_est_end = date_est_start + timedelta(days=1)
-    
-    date_utc_start = date_est_start + timedelta(hours=5)  # EST to UTC
-    date_utc_end = date_est_end + timedelta(hours=5)  # EST to UTC
-
-    video_files = []
-    for single_date in (date_utc_start + timedelta(n) for n in range((date_utc_end - date_utc_start).days)):
-        prefix = f"address={address}/camera={camera}/date={single_date.strftime('%Y-%m-%d')}/"
-        response = s3.list_objects_v2(Bucket=bucket, Prefix=prefix)
-        
-        for obj in response.get('Contents', []):
+LOCAL_TIMEZONE = ZoneInfo('America/New_York')  # Aggregates cover local days; keys are partitioned in UTC
+LISTING_WORKERS = 24  # One listing per hour prefix
+MANIFEST_DIR = 'manifests'
+MANIFEST_SETTLE = timedelta(hours=1)  # A day's listing is cached only once it's this far in the past
+
+# Function to get the UTC hour prefixes covering a local day (23, 24 or 25 of them around DST)
+def day_hour_prefixes(address, camera, date_est):
+    day_start = datetime.strptime(date_est, '%Y-%m-%d').replace(tzinfo=LOCAL_TIMEZONE)
+    day_end = day_start + timedelta(days=1)  # Next local midnight
+    hour = day_start.astimezone(timezone.utc)
+    prefixes = []
+    while hour < day_end:
+        prefixes.append(f"address={address}/camera={camera}/date={hour.strftime('%Y-%m-%d')}/hour={hour.strftime('%H')}/")
+        hour += timedelta(hours=1)
+    return prefixes, day_end
+
+# Function to list every video object under one prefix, following continuation tokens
+def list_prefix(bucket, prefix):
+    objects = []
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
             if re.search(r'\.(mp4|mkv)$', obj['Key']):
-                video_files.append(obj['Key'])
-                if limit and len(video_files) >= limit:
-                    break
-        if limit and len(video_files) >= limit:
-            break
+                objects.append({'key': obj['Key'], 'etag': obj['ETag'].strip('"'), 'size': obj['Size']})
+    return objects
+
+# Function to order clips by the capture time in their file name (video_YYYYmmdd-HHMMSS)
+def capture_time(key):
+    match = re.search(r'video_(\d{8}-\d{6})', key)
+    return match.group(1) if match else key.split('/')[-1]
+
+# Function to list a local day's clips, from the manifest cache when the day is settled
+def list_day_objects(bucket, address, camera, date_est, refresh=False):
+    manifest_file = os.path.join(MANIFEST_DIR, f"address={address}_camera={camera}_date={date_est}.json")
+    if not refresh and os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            objects = json.load(f)
+        print(f"Using cached listing of {len(objects)} clips from {manifest_file}")
+        return objects
+
+    prefixes, day_end = day_hour_prefixes(address, camera, date_est)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=LISTING_WORKERS) as executor:
+        listings = executor.map(lambda prefix: list_prefix(bucket, prefix), prefixes)
+        objects = sorted((obj for listing in listings for obj in listing), key=lambda obj: capture_time(obj['key']))
+    print(f"Listed {len(objects)} clips across {len(prefixes)} hour prefixes")
 
-    return video_files
+    # Only cache days that can no longer gain clips
+    if datetime.now(timezone.utc) >= day_end + MANIFEST_SETTLE:
+        os.makedirs(MANIFEST_DIR, exist_ok=True)
+        with open(manifest_file + '.tmp', 'w') as f:
+            json.dump(objects, f)
+        os.replace(manifest_file + '.tmp', manifest_file)
+    return objects
+
+# Function to get all video files for a given local day from S3, in capture order
+def get_video_files(bucket, address, camera, date_est, limit=None, refresh=False):
+    video_files = [obj['key'] for obj in list_day_objects(bucket, address, camera, date_est, refresh)]
+    return video_files[:limit] if limit else video_files
 
 # Function to download a single video file from S3
 def download_video_file(bucket, key, download_path):
     os.makedirs(download_path, exist_ok=True)
     file_name = os.path.join(download_path, key.split('/')[-1])
     s3.download_file(bucket, key, file_name)
-    print(f"Downloaded {file_name}")
     return file_name
 
-# Function to merge video files using ffmpeg
-def merge_videos(input_files, output_file):
+# Function to download a clip and read its duration and size for the concat timeline and progress
+def fetch_clip(bucket, key, download_path):
+    file_name = download_video_file(bucket, key, download_path)
     try:
-        with open('input.txt', 'w') as f:
-            for file in input_files:
-                f.write(f"file '{file}'\n")
+        duration = float(ffmpeg.probe(file_name)['format']['duration'])
+    except Exception:
+        os.remove(file_name)
+        raise
+    return file_name, duration, os.path.getsize(file_name)
 
-        # Capture ffmpeg output for debugging
-        process = (
-            ffmpeg
-            .input('input.txt', format='concat', safe=0)
-            .output(output_file, c='copy')
-            .run_async(pipe_stdout=True, pipe_stderr=True)
-        )
-        stdout, stderr = process.communicate()
+# Function to stream one clip into the concat process as MPEG-TS, shifted to start at `offset` seconds
+def feed_clip(file_name, offset, sink):
+    process = (
+        ffmpeg
+        .input(file_name)
+        .output('pipe:', format='mpegts', c='copy', output_ts_offset=offset)
+        .global_args('-loglevel', 'error')
+        .run_async(pipe_stdout=True)
+    )
+    try:
+        shutil.copyfileobj(process.stdout, sink)
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    finally:
+        process.stdout.close()
+    return process.wait() == 0
 
-        # Log ffmpeg output
-        print("FFmpeg output:", stdout.decode())
-        print("FFmpeg error:", stderr.decode())
+# Function to delete a prefetched clip nobody will merge (done callback for abandoned downloads)
+def discard_download(future):
+    if not future.cancelled() and future.exception() is None:
+        with contextlib.suppress(OSError):
+            os.remove(future.result()[0])
 
-        if process.returncode != 0:
-            print(f"FFmpeg failed with return code {process.returncode}")
-            return False
+CLIP_STAGING_BYTES = 64 * 1024 * 1024  # A remuxed clip is held in memory up to this size before spilling to disk
+WORK_DIR = 'work'  # Per camera-day checkpoints for --incremental
+CHECKPOINT_INTERVAL = 50  # Clips appended between checkpoint saves
 
-        return True
-    finally:
-        os.remove('input.txt')
-
-# Function to download and merge videos in a sliding window fashion
-def process_videos_in_sliding_window(bucket, video_files, download_path, output_file, window_size):
-    temp_output_file = output_file
-    intermediate_files = []
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
-        for i in range(0, len(video_files), window_size):
-            window_files = video_files[i:i + window_size]
-            
-            # Download videos in parallel
-            download_futures = [executor.submit(download_video_file, bucket, key, download_path) for key in window_files]
-            local_files = [future.result() for future in concurrent.futures.as_completed(download_futures)]
-
-            # Validate downloaded files
-            local_files = [file for file in local_files if os.path.exists(file)]
-            if not local_files:
-                raise FileNotFoundError(f"No valid files downloaded for window {i // window_size}")
-
-            # Merge videos in parallel
-            temp_merged_file = os.path.join(download_path, f"merged_{i // window_size}.mp4")
-            merge_success = merge_videos(local_files, temp_merged_file)
-            if not merge_success or not os.path.exists(temp_merged_file):
-                raise FileNotFoundError(f"Failed to create merged file: {temp_merged_file}")
-
-            intermediate_files.append(temp_merged_file)
-
-            # Clean up local files after processing
-            for file in local_files:
-                if os.path.exists(file):
-                    os.remove(file)
-
-    # Final merge of all intermediate files
-    final_merge_success = merge_videos(intermediate_files, temp_output_file)
-    if not final_merge_success or not os.path.exists(temp_output_file):
-        raise FileNotFoundError(f"Failed to create final merged file: {temp_output_file}")
-
-    # Clean up intermediate files
-    for file in intermediate_files:
-        if os.path.exists(file):
-            os.remove(file)
-
-# Function to generate thumbnails and VTT file
-def generate_thumbnails_and_vtt(bucket, s3_prefix, video_file, thumbnail_dir, vtt_file):
+class AggregationCheckpoint:
+    """
+    Persistent state for one camera-day in incremental mode. day.ts holds every
+    clip appended so far as MPEG-TS (which can simply be appended to), and
+    state.json records the keys/ETags already in it and how many bytes of
+    day.ts are known good. A crashed or repeated run truncates day.ts back to
+    the last checkpoint and appends only the clips it hasn't seen. Clips that
+    failed to download, probe or remux are kept in a skipped list with their
+    ETags and only retried once the object in S3 changes.
+    """
+
+    def __init__(self, work_dir):
+        self.work_dir = work_dir
+        self.spool_file = os.path.join(work_dir, 'day.ts')
+        self.state_file = os.path.join(work_dir, 'state.json')
+        self.listed = {}
+        os.makedirs(work_dir, exist_ok=True)
+        # One run per camera-day at a time, e.g. an hourly refresh overlapping a slow backfill
+        self.lock_file = open(os.path.join(work_dir, 'lock'), 'w')
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        if os.path.exists(self.state_file):
+            with open(self.state_file) as f:
+                self.state = json.load(f)
+            self.state.setdefault('skipped', [])  # Checkpoints from before skipped clips were tracked
+        else:
+            self.reset()
+
+    def reset(self, skipped=()):
+        self.state = {'clips': [], 'duration': 0.0, 'spool_bytes': 0, 'published_clips': 0, 'skipped': list(skipped)}
+
+    def pending(self, objects):
+        """Return the listed objects still to append; start over if already-appended history changed."""
+        self.listed = {obj['key']: obj['etag'] for obj in objects}
+        # A skipped clip stays skipped until S3 has a different object under its key
+        self.state['skipped'] = [clip for clip in self.state['skipped'] if self.listed.get(clip['key']) == clip['etag']]
+        skipped = {clip['key'] for clip in self.state['skipped']}
+        objects = [obj for obj in objects if obj['key'] not in skipped]
+        done = {clip['key']: clip['etag'] for clip in self.state['clips']}
+        changed = [obj['key'] for obj in objects if obj['key'] in done and done[obj['key']] != obj['etag']]
+        new = [obj for obj in objects if obj['key'] not in done]
+        last = capture_time(self.state['clips'][-1]['key']) if self.state['clips'] else None
+        if changed:
+            print(f"{len(changed)} already aggregated clips changed in S3, rebuilding the day")
+        elif last and new and capture_time(new[0]['key']) < last:
+            print(f"Late clip {new[0]['key']} predates the aggregate's end, rebuilding the day")
+        else:
+            print(f"{len(self.state['clips'])} clips already aggregated, {len(new)} new, {len(skipped)} skipped")
+            return new
+        self.reset(self.state['skipped'])
+        return objects
+
+    def skip(self, key):
+        """Remember a clip that couldn't be appended, so later runs don't take it for a late arrival."""
+        self.state['skipped'].append({'key': key, 'etag': self.listed[key]})
+
+    def open_spool(self):
+        spool = open(self.spool_file, 'r+b' if os.path.exists(self.spool_file) else 'w+b')
+        spool.truncate(self.state['spool_bytes'])  # Drop anything written after the last checkpoint
+        spool.seek(self.state['spool_bytes'])
+        return spool
+
+    def record(self, key, duration, spool):
+        self.state['clips'].append({'key': key, 'etag': self.listed[key], 'duration': duration})
+        self.state['duration'] += duration
+        if len(self.state['clips']) % CHECKPOINT_INTERVAL == 0:
+            self.save(spool)
+
+    def save(self, spool=None):
+        if spool:
+            spool.flush()
+            os.fsync(spool.fileno())
+            self.state['spool_bytes'] = spool.tell()
+        with open(self.state_file + '.tmp', 'w') as f:
+            json.dump(self.state, f)
+        os.replace(self.state_file + '.tmp', self.state_file)
+
+    def mark_published(self):
+        self.state['published_clips'] = len(self.state['clips'])
+        self.save()
+
+    def is_published(self):
+        return self.state['published_clips'] == len(self.state['clips']) > 0
+
+THUMBNAIL_INTERVAL = 5  # Seconds of video per scrubbing thumbnail
+THUMBNAIL_WIDTH = 160
+THUMBNAIL_HEIGHT = 90
+SPRITE_COLUMNS = 10  # Thumbnails per sprite sheet row
+SPRITE_ROWS = 10  # Rows per sprite sheet, so each sheet covers 100 thumbnails
+
+# Function to add the sprite sheet output to an ffmpeg graph, so thumbnails come from the same decode
+def sprite_output(stream, thumbnail_dir):
     os.makedirs(thumbnail_dir, exist_ok=True)
+    return (
+        stream.video
+        .filter('fps', fps=f'1/{THUMBNAIL_INTERVAL}')
+        .filter('scale', THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT, force_original_aspect_ratio='decrease')
+        .filter('pad', THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT, '(ow-iw)/2', '(oh-ih)/2')
+        .filter('tile', f'{SPRITE_COLUMNS}x{SPRITE_ROWS}')
+        .output(os.path.join(thumbnail_dir, 'sprite%04d.jpg'), **{'q:v': 5})
+    )
+
+# Function to write the day file and its sprite sheets from one input in one ffmpeg process
+def copy_with_sprites(stream, output_file, thumbnail_dir):
+    return ffmpeg.merge_outputs(
+        stream.output(output_file, map='0', c='copy', movflags='+faststart'),
+        sprite_output(stream, thumbnail_dir),
+    ).global_args('-loglevel', 'error').overwrite_output()
+
+# Function to aggregate a day of clips in one pass
+def aggregate_videos(bucket, video_files, download_path, output_file, thumbnail_dir, prefetch, checkpoint=None, executor=None, job=None):
+    """
+    One long-running ffmpeg reads MPEG-TS on stdin and writes the day's file.
+    Clips are downloaded up to `prefetch` ahead on a thread pool while earlier
+    ones are remuxed into that pipe in order and deleted, so downloads overlap
+    the merge, at most `prefetch` clips sit on disk, and no intermediate files
+    are written; each remuxed clip is staged in memory so one that fails
+    partway never reaches the pipe. If the merge fails, both ffmpeg processes
+    are killed and outstanding downloads are discarded. With a checkpoint, clips are appended to its day.ts instead,
+    which is remuxed into output_file at the end. Either way the process that
+    writes output_file also decodes the video once into thumbnail sprite
+    sheets. Batch runs pass a shared download executor and a Job to report
+    progress on. Returns the day's duration in seconds.
+    """
+    os.makedirs(download_path, exist_ok=True)
+    skipped = 0
+    with contextlib.ExitStack() as stack:
+        if checkpoint:
+            sink = checkpoint.open_spool()
+            offset = checkpoint.state['duration']
+        else:
+            # The concat decodes for thumbnails, so it holds a CPU slot for its lifetime
+            stack.enter_context(ffmpeg_slots)
+            concat = copy_with_sprites(ffmpeg.input('pipe:', format='mpegts'), output_file, thumbnail_dir).run_async(pipe_stdin=True)
+            sink = concat.stdin
+            offset = 0.0
+
+        if executor is None:
+            executor = stack.enter_context(concurrent.futures.ThreadPoolExecutor(max_workers=prefetch))
+        pending = collections.deque(
+            (key, executor.submit(fetch_clip, bucket, key, download_path)) for key in video_files[:prefetch])
+        next_index = len(pending)
+        try:
+            while pending:
+                key, future = pending.popleft()
+                if next_index < len(video_files):
+                    next_key = video_files[next_index]
+                    pending.append((next_key, executor.submit(fetch_clip, bucket, next_key, download_path)))
+                    next_index += 1
+
+                try:
+                    file_name, duration, size = future.result()
+                except Exception as e:
+                    print(f"Skipping clip that failed to download or probe: {e}")
+                    skipped += 1
+                    if checkpoint:
+                        checkpoint.skip(key)
+                    continue
+                if job:
+                    job.clip_done(size)
+
+                try:
+                    if checkpoint:
+                        position = sink.tell()
+                        appended = feed_clip(file_name, offset, sink)
+                        if appended:
+                            checkpoint.record(key, duration, sink)
+                        else:
+                            checkpoint.skip(key)
+                            sink.truncate(position)
+                            sink.seek(position)
+                    else:
+                        # The pipe can't be rewound, so a clip only reaches it once it has remuxed completely
+                        with tempfile.SpooledTemporaryFile(max_size=CLIP_STAGING_BYTES, dir=download_path) as staged:
+                            appended = feed_clip(file_name, offset, staged)
+                            if appended:
+                                staged.seek(0)
+                                shutil.copyfileobj(staged, sink)
+                    if appended:
+                        offset += duration
+                    else:
+                        print(f"Skipping clip that failed to remux: {file_name}")
+                        skipped += 1
+                finally:
+                    os.remove(file_name)
 
-    # Generate thumbnails every 5 seconds
-    ffmpeg.input(video_file).filter('fps', fps=1/5).output(os.path.join(thumbnail_dir, 'thumb%04d.jpg')).run()
+            if not checkpoint:
+                sink.close()
+                if concat.wait() != 0 or not os.path.exists(output_file):
+                    raise FileNotFoundError(f"Failed to create merged file: {output_file}")
+        except BaseException:
+            # Stop prefetching and make sure nothing downloaded for this day is left on disk
+            for _, future in pending:
+                if not future.cancel():
+                    future.add_done_callback(discard_download)
+            if not checkpoint:
+                concat.kill()
+                concat.wait()
+                with contextlib.suppress(OSError):
+                    concat.stdin.close()
+            raise
 
-    # Create VTT file
-    thumbnails = sorted([f for f in os.listdir(thumbnail_dir) if re.search(r'thumb\d+\.jpg', f)])
+    if checkpoint:
+        checkpoint.save(sink)
+        sink.close()
+        try:
+            with ffmpeg_slots:
+                copy_with_sprites(ffmpeg.input(checkpoint.spool_file, format='mpegts'), output_file, thumbnail_dir).run()
+        except ffmpeg.Error:
+            raise FileNotFoundError(f"Failed to create merged file: {output_file}")
+    print(f"Aggregated {len(video_files) - skipped} clips ({offset:.0f}s total) into {output_file}, skipped {skipped}")
+    return offset
+
+# Function to render seconds as a WebVTT timestamp (HH:MM:SS.mmm)
+def vtt_timestamp(seconds):
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    return f"{hours:02}:{minutes:02}:{milliseconds // 1000:02}.{milliseconds % 1000:03}"
+
+# Function to generate sprite sheets from an existing day file (when aggregation was skipped)
+def generate_sprites(video_file, thumbnail_dir):
+    with ffmpeg_slots:
+        sprite_output(ffmpeg.input(video_file), thumbnail_dir).global_args('-loglevel', 'error').overwrite_output().run()
+    return float(ffmpeg.probe(video_file)['format']['duration'])
+
+# Function to write the VTT file pointing each THUMBNAIL_INTERVAL of video at its cell in a sprite sheet
+def generate_vtt(bucket, s3_prefix, duration, vtt_file):
+    per_sheet = SPRITE_COLUMNS * SPRITE_ROWS
+    count = max(1, math.ceil(duration / THUMBNAIL_INTERVAL))
     with open(vtt_file, 'w') as vtt:
         vtt.write('WEBVTT\n\n')
-        for i, thumb in enumerate(thumbnails):
-            timestamp = i * 5
-            vtt.write(f"{timestamp//3600:02}:{(timestamp//60)%60:02}:{timestamp%60:02}.000 --> {timestamp//3600:02}:{(timestamp//60)%60:02}:{(timestamp+5)%60:02}.000\n")
-            # Construct the correct S3 URL for the thumbnail
-            full_url = f"https://{bucket}.s3.amazonaws.com/{s3_prefix}/thumbnails/{thumb}"
-            vtt.write(f"{full_url}\n\n")
-
-# Function to delete existing S3 files in a given prefix
-def delete_existing_s3_files(bucket, prefix):
-    response = s3.list_objects_v2(Bucket=bucket, Prefix=prefix)
-    delete_keys = {'Objects': [{'Key': obj['Key']} for obj in response.get('Contents', [])]}
-    
-    if delete_keys['Objects']:
-        s3.delete_objects(Bucket=bucket, Delete=delete_keys)
-        print(f"Deleted existing files in {prefix}")
+        for i in range(count):
+            start = i * THUMBNAIL_INTERVAL
+            end = min(start + THUMBNAIL_INTERVAL, duration) if duration > start else start + THUMBNAIL_INTERVAL
+            sheet, cell = divmod(i, per_sheet)
+            x = (cell % SPRITE_COLUMNS) * THUMBNAIL_WIDTH
+            y = (cell // SPRITE_COLUMNS) * THUMBNAIL_HEIGHT
+            vtt.write(f"{vtt_timestamp(start)} --> {vtt_timestamp(end)}\n")
+            # Construct the correct S3 URL for the sprite sheet and the thumbnail's cell in it
+            full_url = f"https://{bucket}.s3.amazonaws.com/{s3_prefix}/thumbnails/sprite{sheet + 1:04d}.jpg"
+            vtt.write(f"{full_url}#xywh={x},{y},{THUMBNAIL_WIDTH},{THUMBNAIL_HEIGHT}\n\n")
+
+COMPACT_CRF = 28  # libx264 quality for the compact rendition
+COMPACT_BITRATE = '800k'  # Target bitrate when a hardware encoder (no CRF) is used
+COMPACT_PRESET = 'veryfast'
+COMPACT_AUDIO_BITRATE = '64k'  # AAC; the cameras' audio is speech and ambient noise
+COMPACT_MIN_SLICE = 60  # Seconds; shorter slices cost more in encoder start-up than they gain
+
+# Function to encode one time slice of the day file
+def encode_slice(input_file, start, length, slice_file, encoder, threads):
+    options = {'c:v': encoder, 'c:a': 'aac', 'b:a': COMPACT_AUDIO_BITRATE, 'threads': threads}
+    if encoder == 'libx264':
+        options.update({'crf': COMPACT_CRF, 'preset': COMPACT_PRESET})
     else:
-        print(f"No files to delete in {prefix}")
+        options['b:v'] = COMPACT_BITRATE
+    with ffmpeg_slots:
+        (
+            ffmpeg
+            .input(input_file, ss=start, t=length)
+            .output(slice_file, **options)
+            .global_args('-loglevel', 'error')
+            .overwrite_output()
+            .run()
+        )
+    return slice_file
+
+# Function to transcode the day file into a smaller rendition, encoding time slices in parallel
+def transcode_compact(input_file, output_file, duration, encoder, slices, workers):
+    """
+    Split the day into `slices` independent time ranges, encode them
+    concurrently (each holding an ffmpeg slot, so a batch doesn't oversubscribe
+    the CPU; `workers` is the slot count), then join the parts with a stream-copy concat. Prints the
+    compression ratio and the aggregate encode speed.
+    """
+    slices = max(1, min(slices, int(duration // COMPACT_MIN_SLICE) or 1))
+    slice_length = duration / slices
+    slice_dir = os.path.join(os.path.dirname(output_file), 'compact_slices')
+    clean_directory(slice_dir)
+    threads = max(1, (os.cpu_count() or 1) // min(slices, workers))
+
+    started = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=slices) as executor:
+        slice_files = list(executor.map(
+            lambda i: encode_slice(input_file, i * slice_length, slice_length,
+                                   os.path.join(slice_dir, f"slice{i:04d}.mp4"), encoder, threads),
+            range(slices)))
 
-# Function to upload files to S3
-def upload_files_to_s3(bucket, local_dir, s3_prefix):
+    list_file = os.path.join(slice_dir, 'slices.txt')
+    with open(list_file, 'w') as f:
+        for slice_file in slice_files:
+            f.write(f"file '{os.path.abspath(slice_file)}'\n")
+    (
+        ffmpeg
+        .input(list_file, format='concat', safe=0)
+        .output(output_file, c='copy', movflags='+faststart')
+        .global_args('-loglevel', 'error')
+        .overwrite_output()
+        .run()
+    )
+    elapsed = time.monotonic() - started
+    clean_directory(slice_dir)
+
+    video = next((stream for stream in ffmpeg.probe(input_file)['streams'] if stream['codec_type'] == 'video'), {})
+    numerator, _, denominator = video.get('avg_frame_rate', '15/1').partition('/')
+    frame_rate = float(numerator) / float(denominator or 1) if float(numerator) else 15.0
+    ratio = os.path.getsize(input_file) / max(1, os.path.getsize(output_file))
+    print(f"Compact rendition: {slices} slices with {encoder}, {ratio:.1f}x smaller, "
+          f"{duration * frame_rate / elapsed:.0f} fps encode ({duration / elapsed:.1f}x realtime) in {elapsed:.0f}s")
+    return output_file
+
+UPLOAD_WORKERS = 16  # Concurrent small-object uploads (sprite sheets, VTT)
+DELETE_BATCH_SIZE = 1000  # delete_objects limit per request
+# The day file is several GB: upload it in 64 MB parts, 16 at a time
+LARGE_FILE_TRANSFER = TransferConfig(multipart_threshold=64 * 1024 * 1024, multipart_chunksize=64 * 1024 * 1024,
+                                     max_concurrency=16, use_threads=True)
+
+# Function to delete every object under a prefix except those `keep` accepts, 1000 keys per request
+def delete_s3_objects(bucket, prefix, keep=lambda key: False):
+    deleted = 0
+    batch = []
+
+    def flush():
+        nonlocal deleted
+        response = s3.delete_objects(Bucket=bucket, Delete={'Objects': batch, 'Quiet': True})
+        for error in response.get('Errors', []):
+            print(f"Failed to delete {error['Key']}: {error.get('Message')}")
+        deleted += len(batch) - len(response.get('Errors', []))
+        batch.clear()
+
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if not keep(obj['Key']):
+                batch.append({'Key': obj['Key']})
+                if len(batch) == DELETE_BATCH_SIZE:
+                    flush()
+    if batch:
+        flush()
+    print(f"Deleted {deleted} objects in {prefix}")
+
+# Function to upload a directory's files to S3 in parallel
+def upload_files_to_s3(bucket, local_dir, s3_prefix, executor):
+    futures = []
     for root, _, files in os.walk(local_dir):
         for file in files:
             local_path = os.path.join(root, file)
             relative_path = os.path.relpath(local_path, local_dir)
-            s3_path = f"{s3_prefix}/{relative_path}"
-            s3.upload_file(local_path, bucket, s3_path)
-            print(f"Uploaded {s3_path} to {bucket}")
+            futures.append(executor.submit(s3.upload_file, local_path, bucket, f"{s3_prefix}/{relative_path}"))
+    return futures
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Download, combine video files from S3, generate thumbnails and VTT file, and upload to S3.')
-    parser.add_argument('--date', required=True, help='The EST date for which to process videos (format: YYYY-MM-DD)')
-    parser.add_argument('--skip-download', action='store_true', help='Skip downloading files and assume they are already present locally')
-    parser.add_argument('--test-run', action='store_true', help='Limit to 2 hours of files for a quick test run')
-    parser.add_argument('--window-size', type=int, default=5, help='Number of files to process in each window')
-    args = parser.parse_args()
+# Function to read the version latest.json currently points at (None if there is no pointer yet)
+def read_published_version(bucket, pointer_key):
+    try:
+        response = s3.get_object(Bucket=bucket, Key=pointer_key)
+        return json.loads(response['Body'].read()).get('version')
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+            return None
+        raise
+
+# Function to publish a day's aggregate atomically
+def publish_aggregate(bucket, s3_prefix, version, output_file, thumbnail_dir, vtt_file, compact_file=None):
+    """
+    Upload everything under {s3_prefix}/v={version}/, then point
+    {s3_prefix}/latest.json at it. Readers follow the pointer, so they always
+    see one complete aggregate, never a partial or missing one. The version
+    the pointer replaced is kept for readers that resolved it just before the
+    flip; anything older is deleted, so it goes on the next publish.
+    """
+    version_prefix = f"{s3_prefix}/v={version}"
+    with concurrent.futures.ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+        futures = [executor.submit(s3.upload_file, output_file, bucket, f"{version_prefix}/agg_video.mp4",
+                                   Config=LARGE_FILE_TRANSFER)]
+        futures += upload_files_to_s3(bucket, thumbnail_dir, f"{version_prefix}/thumbnails", executor)
+        futures.append(executor.submit(s3.upload_file, vtt_file, bucket, f"{version_prefix}/thumbnails/thumbnails.vtt"))
+        if compact_file:
+            futures.append(executor.submit(s3.upload_file, compact_file, bucket, f"{version_prefix}/agg_video_compact.mp4",
+                                           Config=LARGE_FILE_TRANSFER))
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+    print(f"Uploaded {len(futures)} objects to s3://{bucket}/{version_prefix}/")
+
+    pointer_key = f"{s3_prefix}/latest.json"
+    previous_version = read_published_version(bucket, pointer_key)
+    pointer = {
+        'version': version,
+        'video': f"{version_prefix}/agg_video.mp4",
+        'vtt': f"{version_prefix}/thumbnails/thumbnails.vtt",
+        'published': datetime.now(timezone.utc).isoformat(),
+    }
+    if compact_file:
+        pointer['compact'] = f"{version_prefix}/agg_video_compact.mp4"
+    s3.put_object(Bucket=bucket, Key=pointer_key, Body=json.dumps(pointer).encode(),
+                  ContentType='application/json', CacheControl='no-cache')
+    print(f"Published s3://{bucket}/{pointer_key} -> v={version}")
+
+    def keep(key):
+        if key == pointer_key or key.startswith(f"{version_prefix}/"):
+            return True
+        if previous_version is None:
+            # There was no pointer before this one, so the previous aggregate is the unversioned layout
+            return not key.startswith(f"{s3_prefix}/v=")
+        return key.startswith(f"{s3_prefix}/v={previous_version}/")
+
+    delete_s3_objects(bucket, f"{s3_prefix}/", keep=keep)
+
+SOURCE_BUCKET = 'casa-cameras-data'
+TARGET_BUCKET = 'casa-cameras-daily-aggregate'
+JOBS_DIR = 'jobs'  # Per camera-day scratch space, so batch jobs don't collide
+PROGRESS_INTERVAL = 30  # Seconds between batch progress lines
+
+# Limits CPU-heavy ffmpeg work (full decodes and remuxes) across all jobs; set from --ffmpeg-workers
+ffmpeg_slots = threading.BoundedSemaphore(max(1, (os.cpu_count() or 2) // 2))
+
+class Job:
+    """One camera-day in a batch, with the counters the progress reporter prints."""
 
-    source_bucket = 'casa-cameras-data'
-    target_bucket = 'casa-cameras-daily-aggregate'
-    address = '720FrontRd'
-    camera = '1'
-    date_est = args.date
-    download_path = 'downloaded_videos'
-    output_file = 'agg_video.mp4'
-    thumbnail_dir = 'thumbnails'
-    vtt_file = 'thumbnails.vtt'
+    def __init__(self, address, camera, date_est):
+        self.address = address
+        self.camera = camera
+        self.date_est = date_est
+        self.status = 'queued'
+        self.total_clips = 0
+        self.done_clips = 0
+        self.bytes = 0
+        self.started = None
+        self.finished = None
+        self.lock = threading.Lock()
+
+    def __str__(self):
+        return f"camera={self.camera} date={self.date_est}"
+
+    def clip_done(self, size):
+        with self.lock:
+            self.done_clips += 1
+            self.bytes += size
+
+    def progress(self):
+        elapsed = (self.finished or time.monotonic()) - self.started if self.started else 0
+        rate = self.bytes / elapsed / 1e6 if elapsed else 0
+        return f"{self}: {self.status} {self.done_clips}/{self.total_clips} clips, {self.bytes / 1e6:.0f} MB, {rate:.1f} MB/s"
+
+# Function to aggregate, thumbnail and publish one camera-day
+def process_day(job, args, executor=None):
+    address, camera, date_est = job.address, job.camera, job.date_est
+    job_dir = os.path.join(JOBS_DIR, f"address={address}", f"camera={camera}", f"date={date_est}")
+    download_path = os.path.join(job_dir, 'downloaded_videos')
+    output_file = os.path.join(job_dir, 'agg_video.mp4')
+    thumbnail_dir = os.path.join(job_dir, 'thumbnails')
+    vtt_file = os.path.join(job_dir, 'thumbnails.vtt')
 
     # Clean directories before starting
+    os.makedirs(job_dir, exist_ok=True)
     clean_directory(download_path)
     clean_directory(thumbnail_dir)
 
-    if not args.skip_download:
-        video_files = get_video_files(source_bucket, address, camera, date_est)
+    checkpoint = None
+    duration = None
+    if args.incremental:
+        checkpoint = AggregationCheckpoint(os.path.join(WORK_DIR, f"address={address}", f"camera={camera}", f"date={date_est}"))
+        objects = list_day_objects(SOURCE_BUCKET, address, camera, date_est, refresh=args.refresh_listing)
+        video_files = [obj['key'] for obj in checkpoint.pending(objects)]
+        if not video_files and checkpoint.is_published():
+            print(f"{job}: aggregate is up to date, nothing to do.")
+            return
+        job.total_clips = len(video_files)
+        duration = aggregate_videos(SOURCE_BUCKET, video_files, download_path, output_file, thumbnail_dir,
+                                    args.window_size, checkpoint, executor, job)
+    elif not args.skip_download:
+        video_files = get_video_files(SOURCE_BUCKET, address, camera, date_est, refresh=args.refresh_listing)
         if args.test_run:
             # Estimate number of files in 2 hours based on typical interval (assuming 5 files per minute)
             video_files = video_files[:600]  # Adjust this estimate based on actual file frequency
-        process_videos_in_sliding_window(source_bucket, video_files, download_path, output_file, args.window_size)
+        job.total_clips = len(video_files)
+        duration = aggregate_videos(SOURCE_BUCKET, video_files, download_path, output_file, thumbnail_dir,
+                                    args.window_size, None, executor, job)
 
     if os.path.exists(output_file):
+        job.status = 'publishing'
         s3_prefix = f"address={address}/camera={camera}/date={date_est}"
-        generate_thumbnails_and_vtt(target_bucket, s3_prefix, output_file, thumbnail_dir, vtt_file)
-        delete_existing_s3_files(target_bucket, s3_prefix)
-        s3.upload_file(output_file, target_bucket, f"{s3_prefix}/agg_video.mp4")
-        upload_files_to_s3(target_bucket, thumbnail_dir, f"{s3_prefix}/thumbnails")
-        s3.upload_file(vtt_file, target_bucket, f"{s3_prefix}/thumbnails/thumbnails.vtt")
-        print(f"Uploaded VTT file to s3://{target_bucket}/{s3_prefix}/thumbnails/thumbnails.vtt")
+        version = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        if duration is None:
+            duration = generate_sprites(output_file, thumbnail_dir)
+        generate_vtt(TARGET_BUCKET, f"{s3_prefix}/v={version}", duration, vtt_file)
+        compact_file = None
+        if args.compact:
+            job.status = 'transcoding'
+            compact_file = transcode_compact(output_file, os.path.join(job_dir, 'agg_video_compact.mp4'), duration,
+                                             args.compact_encoder, args.compact_slices, args.ffmpeg_workers)
+            job.status = 'publishing'
+        publish_aggregate(TARGET_BUCKET, s3_prefix, version, output_file, thumbnail_dir, vtt_file, compact_file)
+        if compact_file:
+            os.remove(compact_file)
+        if checkpoint:
+            checkpoint.mark_published()
         os.remove(output_file)
         print(f"Removed local file: {output_file}")
     else:
-        print("No combined video file to process.")
+        print(f"{job}: no combined video file to process.")
+
+# Function to run a batch of camera-days on shared download and ffmpeg limits, printing progress
+def run_batch(jobs, args):
+    """
+    Jobs run --jobs at a time. Their clip downloads share one pool of
+    --download-workers threads, and full-file ffmpeg work (thumbnail decode,
+    spool remux) is capped at --ffmpeg-workers across all jobs, so network and
+    CPU are limited separately instead of each run sizing its own pool.
+    """
+    stop_reporting = threading.Event()
+
+    def report():
+        while not stop_reporting.wait(PROGRESS_INTERVAL):
+            running = [job for job in jobs if job.status not in ('queued', 'done', 'failed')]
+            finished = sum(1 for job in jobs if job.status in ('done', 'failed'))
+            print(f"Progress: {finished}/{len(jobs)} jobs finished, {len(running)} running")
+            for job in running:
+                print(f"  {job.progress()}")
+
+    def run(job):
+        job.status = 'aggregating'
+        job.started = time.monotonic()
+        try:
+            process_day(job, args, download_executor)
+            job.status = 'done'
+        except Exception as e:
+            job.status = 'failed'
+            print(f"{job}: failed: {e}")
+        job.finished = time.monotonic()
+        print(job.progress())
+
+    started = time.monotonic()
+    reporter = threading.Thread(target=report, daemon=True)
+    reporter.start()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.download_workers) as download_executor, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as job_executor:
+        list(job_executor.map(run, jobs))
+    stop_reporting.set()
+
+    elapsed = time.monotonic() - started
+    total_bytes = sum(job.bytes for job in jobs)
+    failed = [job for job in jobs if job.status == 'failed']
+    print(f"Batch finished: {len(jobs) - len(failed)}/{len(jobs)} jobs, {sum(job.done_clips for job in jobs)} clips, "
+          f"{total_bytes / 1e9:.2f} GB in {elapsed:.0f}s ({total_bytes / elapsed / 1e6 if elapsed else 0:.1f} MB/s)")
+    for job in failed:
+        print(f"  failed: {job}")
+    return not failed
+
+# Function to expand an inclusive date range
+def date_range(start, end):
+    day = datetime.strptime(start, '%Y-%m-%d')
+    last = datetime.strptime(end, '%Y-%m-%d')
+    while day <= last:
+        yield day.strftime('%Y-%m-%d')
+        day += timedelta(days=1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Download, combine video files from S3, generate thumbnails and VTT file, and upload to S3.')
+    parser.add_argument('--date', help='The local (US Eastern) date for which to process videos (format: YYYY-MM-DD)')
+    parser.add_argument('--start-date', help='First date of a batch range (format: YYYY-MM-DD)')
+    parser.add_argument('--end-date', help='Last date of a batch range, inclusive (default: --start-date)')
+    parser.add_argument('--address', default='720FrontRd', help='Address partition to process (default: 720FrontRd)')
+    parser.add_argument('--cameras', default='1', help='Comma-separated camera ids to process (default: 1)')
+    parser.add_argument('--skip-download', action='store_true', help='Skip downloading files and assume they are already present locally')
+    parser.add_argument('--test-run', action='store_true', help='Limit to 2 hours of files for a quick test run')
+    parser.add_argument('--incremental', action='store_true', help='Resume from, and append new clips to, the checkpointed aggregate for the day')
+    parser.add_argument('--refresh-listing', action='store_true', help='Relist S3 even if a cached manifest exists for the day')
+    parser.add_argument('--window-size', type=int, default=16, help='Number of clips downloaded ahead of the merge')
+    parser.add_argument('--jobs', type=int, default=2, help='Camera-days processed at once (default: 2)')
+    parser.add_argument('--download-workers', type=int, default=32, help='Concurrent S3 downloads shared by all jobs (default: 32)')
+    parser.add_argument('--compact', action='store_true', help='Also publish a lower-bitrate agg_video_compact.mp4 transcoded in parallel slices')
+    parser.add_argument('--compact-encoder', default='libx264', help='Encoder for --compact, e.g. h264_v4l2m2m or h264_nvenc (default: libx264)')
+    parser.add_argument('--compact-slices', type=int, default=os.cpu_count() or 1, help='Time slices encoded in parallel for --compact (default: cores)')
+    parser.add_argument('--ffmpeg-workers', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help='Concurrent CPU-heavy ffmpeg runs shared by all jobs (default: half the cores)')
+    args = parser.parse_args()
+
+    if not (args.date or args.start_date):
+        parser.error('one of --date or --start-date is required')
+    ffmpeg_slots = threading.BoundedSemaphore(args.ffmpeg_workers)
+
+    dates = [args.date] if args.date else list(date_range(args.start_date, args.end_date or args.start_date))
+    cameras = [camera.strip() for camera in args.cameras.split(',') if camera.strip()]
+    jobs = [Job(args.address, camera, date_est) for date_est in dates for camera in cameras]
+    if not run_batch(jobs, args):
+        raise SystemExit(1)
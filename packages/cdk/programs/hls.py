@@ -1,5 +1,5 @@
 # Deployment Commands:
-# scp programs/hls.py drabindr@casa5:/home/drabindr/hls.py && ssh drabindr@casa5 'sudo reboot'
+# scp programs/hls.py programs/cloudwatch_metrics.py drabindr@casa5:/home/drabindr/ && ssh drabindr@casa5 'sudo reboot'
 
 import subprocess
 import threading
@@ -17,6 +17,7 @@ import signal
 import logging.handlers
 from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import BotoCoreError, NoCredentialsError, EndpointConnectionError, ClientError
+from cloudwatch_metrics import MetricsBuffer
 
 # Set up directory for logs
 logs_dir = "./logs"
@@ -57,6 +58,7 @@ if not aws_access_key_id or not aws_secret_access_key:
 # Global variables for streaming management
 s3_client = None
 cloudwatch_client = None
+metrics = MetricsBuffer(cloudwatch_namespace)  # Batched sends, off the upload path
 is_uploading = False
 ffmpeg_process = None
 current_run_id = None
@@ -90,6 +92,8 @@ def setup_clients(retries=3):
                 aws_secret_access_key=aws_secret_access_key,
                 region_name=region_name
             )
+            metrics.client = cloudwatch_client
+            metrics.start()
             logging.info("AWS clients initialized.")
             return
         except (NoCredentialsError, BotoCoreError, ClientError, EndpointConnectionError) as e:
@@ -101,23 +105,10 @@ def setup_clients(retries=3):
 #                            CLOUDWATCH METRICS
 ##############################################################################
 def emit_metric(metric_name, value, unit="Count"):
-    """Send a custom metric to CloudWatch if client is initialized, handle exceptions gracefully."""
+    """Record a custom metric; it is aggregated and sent with the next batch if the client is initialized."""
     if cloudwatch_client is None:
         return
-    try:
-        cloudwatch_client.put_metric_data(
-            Namespace=cloudwatch_namespace,
-            MetricData=[
-                {
-                    'MetricName': metric_name,
-                    'Value': value,
-                    'Unit': unit
-                },
-            ]
-        )
-        logging.debug("Emitted CloudWatch metric: %s - %s %s", metric_name, value, unit)
-    except (BotoCoreError, ClientError, EndpointConnectionError) as e:
-        logging.error("Error emitting metric %s: %s", metric_name, e, exc_info=True)
+    metrics.observe(metric_name, value, unit)
 
 def emit_system_metrics():
     """Emit system metrics (CPU, Memory, Disk usage) every 30 minutes indefinitely."""
@@ -444,24 +435,34 @@ def websocket_worker():
         # Sleep before attempting another reconnect
         time.sleep(reconnect_interval)
 
+def handle_shutdown(signum, frame):
+    """SIGTERM/SIGINT: unwind the main thread so the finally block flushes buffered metrics."""
+    logging.info("Received signal %s, shutting down...", signum)
+    sys.exit(0)
+
 ##############################################################################
 #                               MAIN ENTRY
 ##############################################################################
 if __name__ == "__main__":
     logging.info("Script starting...")
+    signal.signal(signal.SIGTERM, handle_shutdown)
+    signal.signal(signal.SIGINT, handle_shutdown)
 
-    # If your environment needs to wait for the network to come up, keep this.
-    time.sleep(60)
+    try:
+        # If your environment needs to wait for the network to come up, keep this.
+        time.sleep(60)
 
-    # Initialize AWS clients
-    setup_clients()
+        # Initialize AWS clients
+        setup_clients()
 
-    # Start system metrics in a separate thread
-    threading.Thread(target=emit_system_metrics, daemon=True).start()
+        # Start system metrics in a separate thread
+        threading.Thread(target=emit_system_metrics, daemon=True).start()
 
-    # WebSocket worker
-    threading.Thread(target=websocket_worker, daemon=True).start()
+        # WebSocket worker
+        threading.Thread(target=websocket_worker, daemon=True).start()
 
-    # Keep main thread alive
-    while True:
-        time.sleep(3600)
+        # Keep main thread alive
+        while True:
+            time.sleep(3600)
+    finally:
+        metrics.close()
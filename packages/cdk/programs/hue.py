@@ -1,10 +1,10 @@
-import websocket
+import asyncio
+import aiohttp
 import json
-import requests
+import random
 import time
 import logging
 from logging import handlers
-import threading
 import os
 
 # Set up logging
@@ -28,53 +28,310 @@ PHILIPS_HUE_USER = "t3SH1fzd1zG6tY5hqygvxFprZkQs1FfFatJwoG-L"
 
 # WebSocket URL (from your WebSocket API)
 WS_URL = "wss://zt4cmsh5r8.execute-api.us-east-1.amazonaws.com/prod"
+WS_HEARTBEAT = 10  # Seconds between pings; the link is dropped if no pong arrives within half that
+WS_MAX_IN_FLIGHT = 16  # Commands being handled at once before we stop reading from the socket
+RECONNECT_MIN_WAIT = 1  # Minimum wait time in seconds
+RECONNECT_MAX_WAIT = 60  # Cap for the exponential backoff window
+
+# Bridge HTTP client: one keep-alive connection pool shared by all commands
+HUE_CONNECT_TIMEOUT = 2  # Seconds to open a connection to the bridge
+HUE_READ_TIMEOUT = 5  # Seconds to wait for the bridge to answer
+HUE_MAX_CONCURRENCY = 8  # Pooled connections to the bridge
+HUE_COMMANDS_PER_SECOND = 10  # The bridge drops light commands sent faster than ~10/s
+HUE_GROUP_COMMANDS_PER_SECOND = 1  # Group actions fan out on the bridge's Zigbee side; ~1/s is the limit
+HUE_GROUPS_MAX_AGE = 60  # Seconds to reuse the bridge's group list for batch commands
+
+# Light state mirror: list_lights is answered from memory and clients get pushed deltas
+HUE_POLL_INTERVAL = 60  # Seconds between background polls of the bridge; our own commands patch the cache directly
+HUE_CACHE_MAX_AGE = 10  # Seconds before list_lights falls back to a live bridge read
+
+bridge_session = None  # aiohttp.ClientSession, created inside the event loop by main()
+BRIDGE_TIMEOUT = aiohttp.ClientTimeout(total=HUE_CONNECT_TIMEOUT + HUE_READ_TIMEOUT, sock_connect=HUE_CONNECT_TIMEOUT)
+
+class RateLimiter:
+    """Token bucket shared by every task that sends light commands to the bridge."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        # Waiters queue on the lock, so tokens are handed out in arrival order
+        async with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.tokens = 1
+                self.updated = time.monotonic()
+            self.tokens -= 1
+
+# RateLimiters hold an asyncio.Lock, so like send_lock they are created inside the loop by main()
+light_command_limiter = None
+group_command_limiter = None
+
+def bridge_url(path):
+    return f"http://{PHILIPS_HUE_BRIDGE_IP}/api/{PHILIPS_HUE_USER}/{path}"
 
 # Function to list lights from the Philips Hue Bridge
-def list_lights():
+async def list_lights():
     try:
-        url = f"http://{PHILIPS_HUE_BRIDGE_IP}/api/{PHILIPS_HUE_USER}/lights"
-        response = requests.get(url)
-        if response.status_code == 200:
-            logger.info("Successfully retrieved lights")
-            return response.json()
-        else:
-            logger.error(f"Failed to retrieve lights: {response.status_code} - {response.content}")
-            return {"error": "Failed to retrieve lights"}
+        async with bridge_session.get(bridge_url("lights")) as response:
+            if response.status == 200:
+                logger.info("Successfully retrieved lights")
+                return await response.json(content_type=None)
+            else:
+                logger.error(f"Failed to retrieve lights: {response.status} - {await response.text()}")
+                return {"error": "Failed to retrieve lights"}
     except Exception as e:
         logger.error(f"Error while fetching lights: {e}")
         return {"error": str(e)}
 
+class LightStateCache:
+    """
+    In-memory copy of the bridge's /lights, refreshed by a background poller.
+    Each refresh diffs against the previous copy and pushes only the changed
+    lights to the connected WebSocket as a "lights_delta" event. Events carry
+    the lights under "lights", not "data", so consumers that take the first
+    message with data as their command's reply (providers/hue.ts) skip them.
+    The poller only runs while a WebSocket is connected.
+    """
+
+    def __init__(self):
+        self.lights = {}
+        self.updated = 0  # Monotonic time of the last successful refresh
+
+    async def get(self):
+        """Return the cached lights, re-reading the bridge if the copy is older than HUE_CACHE_MAX_AGE."""
+        if time.monotonic() - self.updated <= HUE_CACHE_MAX_AGE:
+            return dict(self.lights)
+        lights = await self.refresh()
+        return lights if lights is not None else {"error": "Failed to retrieve lights"}
+
+    async def refresh(self):
+        lights = await list_lights()
+        if not isinstance(lights, dict) or "error" in lights:
+            return None
+        await self.apply(lights, replace=True)
+        return lights
+
+    async def apply(self, lights, replace=False):
+        """Merge (or with replace, swap in) light objects and publish what changed."""
+        delta = {light_id: light for light_id, light in lights.items() if self.lights.get(light_id) != light}
+        if replace:
+            delta.update({light_id: None for light_id in self.lights if light_id not in lights})
+            self.lights = dict(lights)
+            self.updated = time.monotonic()
+        else:
+            self.lights.update(lights)
+        if delta:
+            await publish({"event": "lights_delta", "lights": delta})
+
+    async def update_state(self, light_id, changes):
+        """Patch a light's state after a successful command, ahead of the next poll."""
+        light = self.lights.get(str(light_id))
+        if light is None:
+            return
+        light = dict(light, state=dict(light.get("state", {}), **changes))
+        await self.apply({str(light_id): light})
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(HUE_POLL_INTERVAL)
+            if current_ws is None:
+                continue  # Nobody to push deltas to; list_lights reads the bridge itself when the copy is stale
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Error polling lights: {e}")
+
+light_cache = LightStateCache()
+
 # Function to toggle (trigger) light on or off
-def trigger_light(light_id, state):
+async def trigger_light(light_id, state):
     try:
-        url = f"http://{PHILIPS_HUE_BRIDGE_IP}/api/{PHILIPS_HUE_USER}/lights/{light_id}/state"
         payload = {"on": state}
-        response = requests.put(url, json=payload)
-        if response.status_code == 200:
-            logger.info(f"Successfully set light {light_id} to {'on' if state else 'off'}")
-            return {"success": True, "light_id": light_id, "state": state}
-        else:
-            logger.error(f"Failed to set light {light_id}: {response.status_code} - {response.content}")
-            return {"error": "Failed to set light state"}
+        await light_command_limiter.acquire()
+        async with bridge_session.put(bridge_url(f"lights/{light_id}/state"), json=payload) as response:
+            if response.status == 200:
+                logger.info(f"Successfully set light {light_id} to {'on' if state else 'off'}")
+                await light_cache.update_state(light_id, {"on": state})
+                return {"success": True, "light_id": light_id, "state": state}
+            else:
+                logger.error(f"Failed to set light {light_id}: {response.status} - {await response.text()}")
+                return {"error": "Failed to set light state"}
     except Exception as e:
         logger.error(f"Error while triggering light: {e}")
         return {"error": str(e)}
 
-# WebSocket event handlers
-def on_message(ws, message):
-    logger.info(f"Received message: {message}")
+
+# Friendly names accepted in batch state objects, mapped to Hue v1 state keys
+STATE_KEY_ALIASES = {
+    "brightness": "bri",
+    "colorTemp": "ct",
+    "hue": "hue",
+    "saturation": "sat",
+    "xy": "xy",
+    "on": "on",
+    "bri": "bri",
+    "ct": "ct",
+    "sat": "sat",
+    "transitiontime": "transitiontime",
+}
+NUMERIC_STATE_KEYS = {"bri", "ct", "hue", "sat", "transitiontime"}
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def normalize_state(state):
+    """Turn a batch state (bool or object) into a Hue v1 state body. transition is in milliseconds."""
+    if isinstance(state, bool):
+        return {"on": state}
+    if not isinstance(state, dict) or not state:
+        raise ValueError(f"Invalid state: {state!r}")
+    payload = {}
+    for key, value in state.items():
+        if key == "transition":
+            if not is_number(value) or value < 0:
+                raise ValueError(f"Invalid transition: {value!r}")
+            payload["transitiontime"] = int(round(value / 100))  # Hue counts in 100 ms steps
+        elif key in STATE_KEY_ALIASES:
+            hue_key = STATE_KEY_ALIASES[key]
+            if hue_key in NUMERIC_STATE_KEYS and (not is_number(value) or value < 0):
+                raise ValueError(f"Invalid {key}: {value!r}")
+            if hue_key == "on" and not isinstance(value, bool):
+                raise ValueError(f"Invalid on: {value!r}")
+            if hue_key == "xy" and not (isinstance(value, list) and len(value) == 2 and all(is_number(v) for v in value)):
+                raise ValueError(f"Invalid xy: {value!r}")
+            payload[hue_key] = value
+        else:
+            raise ValueError(f"Unsupported state key: {key}")
+    return payload
+
+async def put_state(path, payload, limiter):
+    """PUT a state body to the bridge; returns None on success or an error string."""
+    await limiter.acquire()
+    async with bridge_session.put(bridge_url(path), json=payload) as response:
+        if response.status != 200:
+            return f"HTTP {response.status}"
+        body = await response.json(content_type=None)
+    # The bridge answers 200 with per-attribute error entries when part of a change fails
+    errors = [item["error"].get("description", "error") for item in body
+              if isinstance(item, dict) and "error" in item]
+    return "; ".join(errors) or None
+
+groups_cache = {"groups": None, "updated": 0}
+
+async def list_groups():
+    """Return {group_id: set(light_ids)} from the bridge, cached for HUE_GROUPS_MAX_AGE."""
+    if groups_cache["groups"] is None or time.monotonic() - groups_cache["updated"] > HUE_GROUPS_MAX_AGE:
+        async with bridge_session.get(bridge_url("groups")) as response:
+            response.raise_for_status()
+            groups = await response.json(content_type=None)
+        groups_cache["groups"] = {group_id: set(group.get("lights", [])) for group_id, group in groups.items()}
+        groups_cache["updated"] = time.monotonic()
+    return groups_cache["groups"]
+
+async def plan_batch(light_ids):
+    """
+    Cover a set of lights that share one state with as few bridge calls as possible:
+    group 0 if it's every light, otherwise the largest groups that fit entirely
+    inside the set, then single-light PUTs for whatever is left.
+    """
+    remaining = set(light_ids)
+    calls = []
+    try:
+        groups = await list_groups()
+    except Exception as e:
+        logger.error(f"Error fetching groups, falling back to per-light commands: {e}")
+        groups = {}
+    all_lights = set(await light_cache.get()) if len(remaining) > 1 else set()
+    if all_lights and remaining == all_lights:
+        return [("groups/0/action", sorted(remaining))]
+    for group_id, group_lights in sorted(groups.items(), key=lambda item: -len(item[1])):
+        if len(group_lights) > 1 and group_lights <= remaining:
+            calls.append((f"groups/{group_id}/action", sorted(group_lights)))
+            remaining -= group_lights
+    calls.extend((f"lights/{light_id}/state", [light_id]) for light_id in sorted(remaining))
+    return calls
+
+async def trigger_lights(lights):
+    """
+    Apply many light states in one go. lights is a list of {"lightId", "state"};
+    lights sharing a state are sent as group actions where a bridge group
+    matches. Returns one aggregated result with a per-light outcome; entries
+    without a usable lightId are reported under "lights[<index>]".
+    """
+    by_state = {}
+    results = {}
+    for index, entry in enumerate(lights):
+        light_id = entry.get("lightId") if isinstance(entry, dict) else None
+        if isinstance(light_id, bool) or not isinstance(light_id, (str, int)) or str(light_id) == "":
+            results[f"lights[{index}]"] = {"success": False, "error": "Missing or invalid lightId"}
+            continue
+        light_id = str(light_id)
+        try:
+            payload = normalize_state(entry.get("state"))
+        except ValueError as e:
+            results[light_id] = {"success": False, "error": str(e)}
+            continue
+        key = json.dumps(payload, sort_keys=True)
+        by_state.setdefault(key, (payload, set()))[1].add(light_id)
+
+    calls = []
+    for payload, light_ids in by_state.values():
+        for path, covered in await plan_batch(light_ids):
+            limiter = group_command_limiter if path.startswith("groups/") else light_command_limiter
+            calls.append((path, covered, payload, put_state(path, payload, limiter)))
+
+    outcomes = await asyncio.gather(*(call for _, _, _, call in calls), return_exceptions=True)
+    for (path, covered, payload, _), error in zip(calls, outcomes):
+        if isinstance(error, Exception):
+            error = str(error) or type(error).__name__
+        for light_id in covered:
+            results[light_id] = {"success": error is None, "via": path}
+            if error:
+                results[light_id]["error"] = error
+            else:
+                await light_cache.update_state(light_id, {key: value for key, value in payload.items() if key != "transitiontime"})
+
+    succeeded = sum(1 for result in results.values() if result["success"])
+    logger.info(f"Batch set {succeeded}/{len(results)} lights with {len(calls)} bridge calls")
+    return {"success": succeeded == len(results), "calls": len(calls), "lights": results}
+
+current_ws = None  # The open WebSocket, for pushes that aren't replies to a command
+send_lock = None  # asyncio.Lock serialising writes to the WebSocket, created by main()
+
+async def send_response(ws, response):
+    async with send_lock:
+        await ws.send_str(json.dumps(response))
+
+async def publish(message):
+    ws = current_ws
+    if ws is None or ws.closed:
+        return
+    try:
+        await send_response(ws, message)
+    except Exception as e:
+        logger.error(f"Error publishing {message.get('event')}: {e}")
+
+async def handle_message(ws, message):
     try:
         data = json.loads(message)
 
         # Handle the "list_lights" command
         if data.get("command") == "list_lights":
-            lights = list_lights()
+            lights = await light_cache.get()
 
             # Send the result back to the WebSocket
-            ws.send(json.dumps({
+            await send_response(ws, {
                 "response": "list_lights",
                 "data": lights
-            }))
+            })
 
         # Handle the "trigger_light" command
         elif data.get("command") == "trigger_light":
@@ -84,49 +341,109 @@ def on_message(ws, message):
             state = light_data.get("state")
 
             if light_id is not None and state is not None:
-                result = trigger_light(light_id, state)
+                result = await trigger_light(light_id, state)
 
                 # Send the result back to the WebSocket
-                ws.send(json.dumps({
+                await send_response(ws, {
                     "response": "trigger_light_response",
                     "data": result
-                }))
+                })
             else:
                 logger.error("Invalid lightId or state received")
-                ws.send(json.dumps({
+                await send_response(ws, {
                     "response": "trigger_light_response",
                     "error": "Invalid lightId or state"
-                }))
+                })
+
+        # Handle the "trigger_lights" batch command
+        elif data.get("command") == "trigger_lights":
+            lights = data.get("data", {}).get("lights")
+            if isinstance(lights, list) and lights:
+                await send_response(ws, {
+                    "response": "trigger_lights_response",
+                    "data": await trigger_lights(lights)
+                })
+            else:
+                logger.error("Invalid lights list received")
+                await send_response(ws, {
+                    "response": "trigger_lights_response",
+                    "error": "Invalid lights list"
+                })
     except Exception as e:
         logger.error(f"Error processing message: {e}")
 
-def on_open(ws):
-    logger.info("WebSocket connection opened")
+async def read_commands(ws):
+    """
+    Hand each command to its own task, with at most WS_MAX_IN_FLIGHT running.
+    When the window is full we stop reading, so a backlog stays in the socket
+    buffers (and eventually TCP flow control) rather than piling up in memory.
+    """
+    window = asyncio.Semaphore(WS_MAX_IN_FLIGHT)
+    tasks = set()  # Strong references, so the loop can't garbage-collect a running command
 
-def on_error(ws, error):
-    logger.error(f"WebSocket error: {error}")
+    def finished(task):
+        tasks.discard(task)
+        window.release()
 
-def on_close(ws, close_status_code, close_msg):
-    logger.info(f"WebSocket closed: {close_status_code} - {close_msg}")
-    # No recursive call here
+    try:
+        async for msg in ws:
+            if msg.type == aiohttp.WSMsgType.TEXT:
+                logger.info(f"Received message: {msg.data}")
+                await window.acquire()
+                task = asyncio.create_task(handle_message(ws, msg.data))
+                tasks.add(task)
+                task.add_done_callback(finished)
+            elif msg.type == aiohttp.WSMsgType.ERROR:
+                logger.error(f"WebSocket error: {ws.exception()}")
+                break
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()  # Shutting down: don't wait on the bridge
+        raise
+    finally:
+        # Let commands already sent to the bridge finish before reconnecting; their replies may be lost
+        if tasks:
+            logger.info(f"Waiting for {len(tasks)} in-flight command(s) before reconnecting")
+            await asyncio.gather(*tasks, return_exceptions=True)
 
 # Start the WebSocket client with reconnection logic
-def run_websocket_client():
+async def run_websocket_client(session):
+    global current_ws
+    attempt = 0
     while True:
         try:
-            ws = websocket.WebSocketApp(
-                WS_URL,
-                on_open=on_open,
-                on_message=on_message,
-                on_error=on_error,
-                on_close=on_close
-            )
-            ws.run_forever()
+            async with session.ws_connect(WS_URL, heartbeat=WS_HEARTBEAT) as ws:
+                logger.info("WebSocket connection opened")
+                attempt = 0
+                current_ws = ws
+                await read_commands(ws)
+                logger.info(f"WebSocket closed: {ws.close_code}")
         except Exception as e:
             logger.error(f"Exception in WebSocket connection: {e}")
-        logger.info("WebSocket connection closed, reconnecting in 5 seconds")
-        time.sleep(5)
+        finally:
+            current_ws = None
+
+        # Full jitter so many clients don't reconnect in lockstep after an outage
+        wait = random.uniform(RECONNECT_MIN_WAIT, min(RECONNECT_MAX_WAIT, RECONNECT_MIN_WAIT * 2 ** attempt))
+        attempt += 1
+        logger.info(f"WebSocket connection closed, reconnecting in {wait:.1f} seconds")
+        await asyncio.sleep(wait)
+
+async def main():
+    global bridge_session, send_lock, light_command_limiter, group_command_limiter
+    send_lock = asyncio.Lock()
+    light_command_limiter = RateLimiter(HUE_COMMANDS_PER_SECOND)
+    group_command_limiter = RateLimiter(HUE_GROUP_COMMANDS_PER_SECOND)
+    connector = aiohttp.TCPConnector(limit=HUE_MAX_CONCURRENCY)
+    async with aiohttp.ClientSession(connector=connector, timeout=BRIDGE_TIMEOUT) as session, \
+            aiohttp.ClientSession() as ws_session:
+        bridge_session = session
+        poller = asyncio.create_task(light_cache.run())
+        try:
+            await run_websocket_client(ws_session)
+        finally:
+            poller.cancel()
 
 if __name__ == "__main__":
     logger.info("Starting WebSocket client for Philips Hue control")
-    run_websocket_client()
+    asyncio.run(main())
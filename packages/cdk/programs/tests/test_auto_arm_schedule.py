@@ -0,0 +1,93 @@
+"""
+Auto-arm schedule reloads. casa-main.py isn't importable by name, so it is loaded
+from its path; run with `python -m unittest discover -s tests` from packages/cdk/programs.
+"""
+
+import importlib.util
+import json
+import os
+import tempfile
+import unittest
+
+PROGRAM = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "casa-main.py")
+
+
+def load_casa_main():
+    spec = importlib.util.spec_from_file_location("casa_main", PROGRAM)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+try:
+    casa_main = load_casa_main()
+except ImportError:  # websocket-client, boto3 or pytz not installed
+    casa_main = None
+
+
+@unittest.skipIf(casa_main is None, "casa-main.py dependencies are not installed")
+class AutoArmScheduleReloadTest(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".json")
+        os.close(handle)
+        self.edits = 0
+        self.write({"timezone": "US/Pacific", "windows": [{"arm": "22:00", "disarm": "06:00", "mode": "Arm Away"}]})
+        self.schedule = casa_main.AutoArmSchedule(self.path)
+        self.schedule.refresh(0)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def write(self, auto_arm):
+        with open(self.path, "w") as config_file:
+            json.dump({"autoArm": auto_arm}, config_file)
+        # Make every write look like an edit, even within the filesystem's mtime resolution
+        stat = os.stat(self.path)
+        self.edits += 1
+        os.utime(self.path, (stat.st_atime, stat.st_mtime + self.edits))
+
+    def reload(self):
+        self.schedule.file_check_at = 0
+        self.schedule.refresh(0)
+
+    def assert_unchanged(self):
+        self.assertEqual(self.schedule.tz.zone, "US/Pacific")
+        self.assertEqual([(str(arm), str(disarm), mode) for arm, disarm, mode, _ in self.schedule.windows],
+                         [("22:00:00", "06:00:00", "Arm Away")])
+
+    def test_initial_load(self):
+        self.assert_unchanged()
+
+    def test_bad_time_keeps_previous_schedule(self):
+        self.write({"timezone": "US/Pacific", "windows": [{"arm": "2:30am", "disarm": "05:30"}]})
+        self.reload()
+        self.assert_unchanged()
+
+    def test_missing_key_keeps_previous_schedule(self):
+        self.write({"timezone": "US/Pacific", "windows": [{"arm": "02:30"}]})
+        self.reload()
+        self.assert_unchanged()
+
+    def test_unknown_timezone_keeps_previous_schedule(self):
+        self.write({"timezone": "Mars/Olympus", "windows": []})
+        self.reload()
+        self.assert_unchanged()
+
+    def test_invalid_json_keeps_previous_schedule(self):
+        with open(self.path, "w") as config_file:
+            config_file.write("{not json")
+        os.utime(self.path, (0, 12345))
+        self.reload()
+        self.assert_unchanged()
+
+    def test_good_edit_replaces_schedule(self):
+        self.write({"timezone": "US/Eastern", "windows": [{"arm": "01:00", "disarm": "02:00"}]})
+        self.reload()
+        self.assertEqual(self.schedule.tz.zone, "US/Eastern")
+        self.assertEqual(len(self.schedule.windows), 1)
+        self.assertEqual(self.schedule.windows[0][2], "Arm Stay")
+
+
+if __name__ == "__main__":
+    unittest.main()